@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import shlex
+import sys
+
+# Subcommand -> module implementing it. Modules are imported only when their command runs,
+# so quick commands never pay for the heavy ones.
+COMMANDS = {
+    ('backup', 'dvwa'): 'dvwa_backup',
+    ('backup', 'pfsense'): 'pfsense_backup',
+    ('restore', 'dvwa'): 'dvwa_restore',
+    ('restore', 'pfsense'): 'pfsense_restore',
+    ('users', 'list'): 'dvwa_show_users',
+    ('users', 'add'): 'dvwa_add_user',
+    ('users', 'delete'): 'dvwa_delete_user',
+    ('binlog',): 'dvwa_binlog',
+    ('diff',): 'pfsense_diff',
+    ('watch',): 'change_watch',
+    ('spool',): 'upload_spool',
+    ('inspect',): 'dumpfile',
+    ('history',): 'run_history',
+}
+
+# Backup targets run by `fleet`, in order: (name, module, env var that enables it)
+FLEET = [
+    ('dvwa', 'dvwa_backup', 'DVWA_HOST'),
+    ('pfsense', 'pfsense_backup', 'PFSENSE_HOST'),
+]
+
+# Local artifact kinds shown by `catalog`: (kind, filename prefix, suffix or tuple of suffixes)
+CATALOG_KINDS = [
+    ('pfsense', 'pfsense_backup_', '.xml'),
+    ('dvwa-source', 'dvwa_source_backup_', '.tar.gz'),
+    ('dvwa-db', 'dvwa_db_backup_', ('.sql', '.sql.gz')),
+]
+
+
+def run_module(module, argv):
+    from common import run_main
+    return run_main(module, argv)
+
+
+def cmd_module(args):
+    return run_module(args.module, args.args)
+
+
+def cmd_fleet(args):
+    from common import load_config
+    cfg = load_config()
+
+    unknown = set(args.only) - {name for name, _, _ in FLEET}
+    if unknown:
+        print(f"Unknown fleet target(s): {', '.join(sorted(unknown))}")
+        return 1
+
+    results = []
+    for name, module, enabled_by in FLEET:
+        if args.only and name not in args.only:
+            continue
+        if not getattr(cfg, enabled_by):
+            print(f"Skipping {name}: {enabled_by} is not set.")
+            continue
+        print(f"=== {name} ===")
+        results.append((name, run_module(module, [])))
+
+    print("\nFleet summary:")
+    for name, code in results:
+        print(f"  {name}: {'OK' if code == 0 else f'FAILED (exit {code})'}")
+    return 0 if all(code == 0 for _, code in results) else 1
+
+
+def cmd_catalog(args):
+    from common import format_size, load_config, require
+    cfg = load_config()
+    require(cfg, 'LOCAL_BACKUP_DIR')
+
+    if not os.path.isdir(cfg.LOCAL_BACKUP_DIR):
+        print(f"No backups yet: {cfg.LOCAL_BACKUP_DIR} does not exist.")
+        return 0
+
+    entries = {kind: [] for kind, _, _ in CATALOG_KINDS}
+    with os.scandir(cfg.LOCAL_BACKUP_DIR) as it:
+        for entry in it:
+            for kind, prefix, suffix in CATALOG_KINDS:
+                if entry.name.startswith(prefix) and entry.name.endswith(suffix) and entry.is_file():
+                    entries[kind].append((entry.name, entry.stat().st_size))
+                    break
+
+    for kind, _, _ in CATALOG_KINDS:
+        if args.kind and kind != args.kind:
+            continue
+        files = sorted(entries[kind], reverse=True)
+        print(f"{kind} ({len(files)}):")
+        for name, size in files[:args.limit or None]:
+            print(f"  {format_size(size):>8}  {name}")
+    return 0
+
+
+def cmd_shell(args):
+    # Keeps config, tool probes and imported modules warm across many commands
+    parser = build_parser()
+    interactive = sys.stdin.isatty()
+    while True:
+        try:
+            line = input('backupctl> ' if interactive else '')
+        except EOFError:
+            break
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line in ('exit', 'quit'):
+            break
+        try:
+            argv = shlex.split(line)
+            if argv[0] == 'shell':
+                print("Already in a shell.")
+                continue
+            sub_args = parse(parser, argv)
+        except (ValueError, SystemExit):
+            continue
+        code = sub_args.func(sub_args)
+        if code:
+            print(f"(exit {code})")
+    return 0
+
+
+def parse(parser, argv):
+    # Script subcommands take their own options, which argparse.REMAINDER misses when they lead
+    args, extra = parser.parse_known_args(argv)
+    if extra:
+        if args.func is not cmd_module:
+            parser.error(f"unrecognized arguments: {' '.join(extra)}")
+        args.args = extra + args.args
+    return args
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='backupctl', description="Backup and restore pfSense and DVWA")
+    sub = parser.add_subparsers(dest='command', metavar='<command>')
+    sub.required = True
+
+    groups = {}
+    for key, module in COMMANDS.items():
+        if len(key) == 1:
+            p = sub.add_parser(key[0], help=f"run {module}.py", add_help=False)
+        else:
+            if key[0] not in groups:
+                group = sub.add_parser(key[0], help=f"{key[0]} commands")
+                groups[key[0]] = group.add_subparsers(dest='action', metavar='<action>')
+                groups[key[0]].required = True
+            p = groups[key[0]].add_parser(key[1], help=f"run {module}.py", add_help=False)
+        p.add_argument('args', nargs=argparse.REMAINDER)
+        p.set_defaults(func=cmd_module, module=module)
+
+    p = sub.add_parser('fleet', help="back up every configured target")
+    p.add_argument('only', nargs='*', metavar='target', help=f"limit to these targets ({', '.join(n for n, _, _ in FLEET)})")
+    p.set_defaults(func=cmd_fleet)
+
+    p = sub.add_parser('catalog', help="list local backup artifacts")
+    p.add_argument('--kind', choices=[kind for kind, _, _ in CATALOG_KINDS])
+    p.add_argument('--limit', type=int, default=0, help="show at most N newest per kind")
+    p.set_defaults(func=cmd_catalog)
+
+    p = sub.add_parser('shell', help="read commands from stdin in one process")
+    p.set_defaults(func=cmd_shell)
+    return parser
+
+
+def main(argv=None):
+    args = parse(build_parser(), argv)
+    sys.exit(args.func(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from common import (
+    dvwa_ssh_cmd, ensure_backup_dir, load_config, pfsense_ssh_cmd, require, run_main,
+)
+
+STATE_FILE = '.watch_state.json'
+
+
+def dvwa_fingerprint(cfg):
+    # Cheap change signals: ctime/size summary of the web root plus the binlog position,
+    # falling back to table checksums when binary logging is off.
+    # ctime is used instead of mtime because `touch -r` can fake mtime but not ctime.
+    mysql_base = f"mysql -u {cfg.DVWA_DB_USER} -p'{cfg.DVWA_DB_PASSWORD}' -sN"
+    tables_sql = f"SELECT GROUP_CONCAT(table_name) FROM information_schema.tables WHERE table_schema = '{cfg.DVWA_DB_NAME}'"
+    probe_cmd = (
+        f"cd {cfg.DVWA_WEB_PATH} && find dvwa -printf '%C@ %s %p\\n' | sort | md5sum; "
+        f"POS=$({mysql_base} -e 'SHOW MASTER STATUS' | cut -f1,2); "
+        f"if [ -n \"$POS\" ]; then echo \"binlog $POS\"; else "
+        f"TABLES=$({mysql_base} -e \"{tables_sql}\"); "
+        f"{mysql_base} {cfg.DVWA_DB_NAME} -e \"CHECKSUM TABLE $TABLES\" | md5sum; fi"
+    )
+    result = subprocess.run(dvwa_ssh_cmd(cfg, probe_cmd), capture_output=True, text=True)
+    if result.returncode != 0 or not result.stdout.strip():
+        return None
+    return result.stdout.strip()
+
+
+def pfsense_fingerprint(cfg):
+    # pfSense rewrites config.xml (with a new revision) on every saved change
+    result = subprocess.run(pfsense_ssh_cmd(cfg, f"cksum {cfg.PFSENSE_BACKUP_PATH}"), capture_output=True, text=True)
+    if result.returncode != 0 or not result.stdout.strip():
+        return None
+    return result.stdout.split()[0]
+
+
+# Watched targets: name -> (fingerprint function, backup module, env var that enables it)
+TARGETS = {
+    'dvwa': (dvwa_fingerprint, 'dvwa_backup', 'DVWA_HOST'),
+    'pfsense': (pfsense_fingerprint, 'pfsense_backup', 'PFSENSE_HOST'),
+}
+
+
+class Watch:
+    # Debounces change signals per target: a backup starts once the target has been quiet for
+    # WATCH_DEBOUNCE seconds, or WATCH_MAX_DELAY seconds after the first unprotected change.
+    # A failed backup is retried after WATCH_DEBOUNCE seconds, doubling up to WATCH_MAX_DELAY.
+
+    def __init__(self, cfg, names):
+        self.cfg = cfg
+        self.names = names
+        self.state_path = os.path.join(cfg.LOCAL_BACKUP_DIR, STATE_FILE)
+        # name -> fingerprint covered by the last successful backup
+        self.backed_up = self._load_state()
+        # name -> (fingerprint seen last poll, first change time, last change time)
+        self.pending = {}
+        # name -> (earliest retry time, consecutive failures) after a failed backup
+        self.retry = {}
+
+    def _load_state(self):
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_state(self):
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.backed_up, f)
+        os.replace(tmp_path, self.state_path)
+
+    def poll(self, name, now):
+        fingerprint_fn, module, _ = TARGETS[name]
+        fingerprint = fingerprint_fn(self.cfg)
+        if fingerprint is None:
+            print(f"[{name}] Could not read change signals, will retry.")
+            return
+
+        if fingerprint == self.backed_up.get(name):
+            self.pending.pop(name, None)
+            self.retry.pop(name, None)
+            return
+
+        seen, first_change, last_change = self.pending.get(name, (None, now, now))
+        if fingerprint != seen:
+            if seen is None:
+                print(f"[{name}] Change detected, waiting for it to settle...")
+            last_change = now
+        self.pending[name] = (fingerprint, first_change, last_change)
+
+        retry_at, failures = self.retry.get(name, (0, 0))
+        if now < retry_at:
+            return
+
+        quiet_for = now - last_change
+        waiting_for = now - first_change
+        if quiet_for < self.cfg.WATCH_DEBOUNCE and waiting_for < self.cfg.WATCH_MAX_DELAY:
+            return
+
+        print(f"[{name}] Starting backup (quiet for {quiet_for:.0f}s, first change {waiting_for:.0f}s ago)...")
+        if run_main(module) == 0:
+            # Changes made while the backup ran differ from this fingerprint and trigger again
+            self.backed_up[name] = fingerprint
+            self.save_state()
+            self.pending.pop(name, None)
+            self.retry.pop(name, None)
+            print(f"[{name}] Backup finished.")
+        else:
+            # Without a deadline, a target past WATCH_MAX_DELAY would be backed up on every poll
+            failures += 1
+            longest = max(self.cfg.WATCH_MAX_DELAY, self.cfg.WATCH_DEBOUNCE)
+            delay = min(self.cfg.WATCH_DEBOUNCE * 2 ** (failures - 1), longest)
+            self.retry[name] = (time.monotonic() + delay, failures)
+            print(f"[{name}] Backup failed ({failures} in a row), will retry in {delay}s.")
+
+    def run(self):
+        while True:
+            for name in self.names:
+                self.poll(name, time.monotonic())
+            time.sleep(self.cfg.WATCH_INTERVAL)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run backups when DVWA or pfSense actually change")
+    parser.add_argument('targets', nargs='*', metavar='target', help=f"limit to these targets ({', '.join(TARGETS)})")
+    parser.add_argument('--baseline', action='store_true',
+                        help="record the current state as backed up without running backups, then exit")
+    args = parser.parse_args(argv)
+
+    unknown = set(args.targets) - set(TARGETS)
+    if unknown:
+        print(f"Unknown watch target(s): {', '.join(sorted(unknown))}")
+        sys.exit(1)
+
+    cfg = load_config()
+    require(cfg, 'LOCAL_BACKUP_DIR')
+    ensure_backup_dir(cfg)
+
+    names = [
+        name for name, (_, _, enabled_by) in TARGETS.items()
+        if (not args.targets or name in args.targets) and getattr(cfg, enabled_by)
+    ]
+    if not names:
+        print("Nothing to watch: set DVWA_HOST and/or PFSENSE_HOST.")
+        sys.exit(1)
+
+    watch = Watch(cfg, names)
+    if args.baseline:
+        for name in names:
+            fingerprint = TARGETS[name][0](cfg)
+            if fingerprint is None:
+                print(f"[{name}] Could not read change signals.")
+                sys.exit(1)
+            watch.backed_up[name] = fingerprint
+        watch.save_state()
+        print(f"Recorded current state of {', '.join(names)} as backed up.")
+        return
+
+    print(f"Watching {', '.join(names)} every {cfg.WATCH_INTERVAL}s "
+          f"(debounce {cfg.WATCH_DEBOUNCE}s, max delay {cfg.WATCH_MAX_DELAY}s)...")
+    try:
+        watch.run()
+    except KeyboardInterrupt:
+        print("\nStopped.")
+
+
+if __name__ == '__main__':
+    main()
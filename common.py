@@ -0,0 +1,265 @@
+import importlib
+import os
+import shutil
+import sys
+from functools import lru_cache
+
+# Every environment variable the scripts understand: name -> (default, type)
+# Types: 'str', 'int', 'float', 'bool', 'port', 'path' (user-expanded), 'secret' (never printed)
+CONFIG_SCHEMA = {
+    # pfSense
+    'PFSENSE_HOST': (None, 'str'),
+    'PFSENSE_USER': (None, 'str'),
+    'PFSENSE_PASSWORD': (None, 'secret'),
+    'PFSENSE_BACKUP_PATH': ('/cf/conf/config.xml', 'str'),
+    'GDRIVE_FILE_ID': (None, 'str'),
+    # DVWA
+    'DVWA_HOST': (None, 'str'),
+    'DVWA_USER': ('root', 'str'),
+    'DVWA_PASSWORD': (None, 'secret'),
+    'DVWA_SSH_PORT': ('2222', 'port'),
+    'DVWA_SSH_KEY': (None, 'path'),
+    'DVWA_WEB_PATH': ('/var/www/html', 'str'),
+    'DVWA_STAGE_PATH': (None, 'str'),
+    'DVWA_DB_NAME': ('dvwa', 'str'),
+    'DVWA_DB_USER': ('root', 'str'),
+    'DVWA_DB_PASSWORD': (None, 'secret'),
+    'DVWA_DB_HOST': ('127.0.0.1', 'str'),
+    'DVWA_DB_PORT': ('3306', 'port'),
+    'DVWA_DB_POOL_SIZE': ('4', 'int'),
+    'DVWA_DUMP_CONSISTENT': ('1', 'bool'),
+    'DVWA_DUMP_BINLOG_COORDS': ('0', 'bool'),
+    'DVWA_DUMP_COMPRESS': ('1', 'bool'),
+    'GDRIVE_SOURCE_FILE_ID': (None, 'str'),
+    'GDRIVE_DB_FILE_ID': (None, 'str'),
+    # Shared
+    'LOCAL_BACKUP_DIR': (None, 'path'),
+    'GDRIVE_FOLDER_ID': (None, 'str'),
+    # Throttling (0 disables each limit)
+    'BACKUP_BWLIMIT_KBPS': ('0', 'int'),
+    'BACKUP_NICE': ('0', 'int'),
+    'BACKUP_MAX_LOAD': ('0', 'float'),
+    'BACKUP_MAX_THREADS_RUNNING': ('0', 'int'),
+    'BACKUP_LOAD_CHECK_INTERVAL': ('10', 'int'),
+    'BACKUP_MAX_PAUSE': ('1800', 'int'),
+    # Change-triggered backups
+    'WATCH_INTERVAL': ('30', 'int'),
+    'WATCH_DEBOUNCE': ('120', 'int'),
+    'WATCH_MAX_DELAY': ('900', 'int'),
+    # Upload spool
+    'UPLOAD_MODE': ('spool', 'str'),
+    'UPLOAD_CONCURRENCY': ('2', 'int'),
+    'UPLOAD_MAX_PER_MINUTE': ('0', 'int'),
+    'UPLOAD_MAX_ATTEMPTS': ('10', 'int'),
+    'UPLOAD_RETRY_BASE': ('60', 'int'),
+    'UPLOAD_RETRY_MAX': ('3600', 'int'),
+    'UPLOAD_LEASE': ('300', 'int'),
+    'UPLOAD_POLL_INTERVAL': ('30', 'int'),
+    # Run history
+    'HISTORY_DB': (None, 'path'),
+    'HISTORY_KEEP_DAYS': ('400', 'int'),
+    'HISTORY_BASELINE_DAYS': ('30', 'int'),
+    'HISTORY_MIN_RUNS': ('5', 'int'),
+    'HISTORY_SHRINK_ALERT': ('0.5', 'float'),
+    'HISTORY_GROWTH_ALERT': ('2.0', 'float'),
+    'HISTORY_LATENCY_ALERT': ('2.0', 'float'),
+}
+
+SSH_OPTS = ['-o', 'StrictHostKeyChecking=no']
+
+
+class Config:
+    # Read-only view of the validated environment; attribute names match the env vars
+
+    def __init__(self, values):
+        self.__dict__.update(values)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Config is read-only")
+
+    def __repr__(self):
+        shown = {
+            k: ('***' if CONFIG_SCHEMA[k][1] == 'secret' and v else v)
+            for k, v in self.__dict__.items()
+        }
+        return f"Config({shown})"
+
+
+def _convert(name, raw, kind):
+    if kind == 'path':
+        return os.path.expanduser(raw)
+    if kind == 'bool':
+        lowered = raw.strip().lower()
+        if lowered in ('1', 'true', 'yes', 'on'):
+            return True
+        if lowered in ('0', 'false', 'no', 'off'):
+            return False
+        raise ValueError(f"{name} must be a boolean (1/0, true/false), got {raw!r}")
+    if kind == 'float':
+        try:
+            return float(raw)
+        except ValueError:
+            raise ValueError(f"{name} must be a number, got {raw!r}")
+    if kind in ('int', 'port'):
+        try:
+            value = int(raw)
+        except ValueError:
+            raise ValueError(f"{name} must be an integer, got {raw!r}")
+        if kind == 'port' and not 0 < value < 65536:
+            raise ValueError(f"{name} must be a TCP port, got {value}")
+        if value < 0:
+            raise ValueError(f"{name} must not be negative, got {value}")
+        return value
+    return raw
+
+
+@lru_cache(maxsize=None)
+def load_config():
+    # Parsed once per process; every subcommand in a long-running backupctl shares it
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    values, errors = {}, []
+    for name, (default, kind) in CONFIG_SCHEMA.items():
+        raw = os.getenv(name) or default
+        if raw is None:
+            values[name] = None
+            continue
+        try:
+            values[name] = _convert(name, raw, kind)
+        except ValueError as e:
+            errors.append(str(e))
+
+    if values.get('BACKUP_NICE') and values['BACKUP_NICE'] > 19:
+        errors.append(f"BACKUP_NICE must be between 0 and 19, got {values['BACKUP_NICE']}")
+    if values.get('UPLOAD_MODE') not in (None, 'spool', 'inline'):
+        errors.append(f"UPLOAD_MODE must be 'spool' or 'inline', got {values['UPLOAD_MODE']!r}")
+    if values.get('HISTORY_SHRINK_ALERT') is not None and not 0 < values['HISTORY_SHRINK_ALERT'] < 1:
+        errors.append(f"HISTORY_SHRINK_ALERT must be between 0 and 1, got {values['HISTORY_SHRINK_ALERT']}")
+    for name in ('UPLOAD_CONCURRENCY', 'UPLOAD_MAX_ATTEMPTS', 'UPLOAD_LEASE'):
+        if values.get(name) == 0:
+            errors.append(f"{name} must be at least 1")
+
+    if errors:
+        for error in errors:
+            print(f"Invalid env var: {error}")
+        sys.exit(1)
+    return Config(values)
+
+
+def require(cfg, *names):
+    for var in names:
+        if not getattr(cfg, var):
+            print(f"Missing required env var: {var}")
+            sys.exit(1)
+
+
+@lru_cache(maxsize=None)
+def has_tool(name):
+    # Probed once per process instead of spawning `which` before every command
+    return shutil.which(name) is not None
+
+
+def require_sshpass():
+    if not has_tool('sshpass'):
+        print("sshpass is required for password authentication. Please install it (e.g., brew install hudochenkov/sshpass/sshpass).")
+        sys.exit(1)
+
+
+# DVWA: SSH key or password authentication
+
+@lru_cache(maxsize=None)
+def dvwa_ssh_auth(cfg):
+    if cfg.DVWA_SSH_KEY and os.path.exists(cfg.DVWA_SSH_KEY):
+        return ('-i', cfg.DVWA_SSH_KEY)
+    if cfg.DVWA_PASSWORD:
+        require_sshpass()
+        return ('sshpass', '-p', cfg.DVWA_PASSWORD)
+    print("Either DVWA_SSH_KEY or DVWA_PASSWORD must be provided.")
+    sys.exit(1)
+
+
+def _with_auth(auth, tool, port_flag, port, args):
+    auth = list(auth)
+    if auth[0] == 'sshpass':
+        return auth + [tool] + SSH_OPTS + [port_flag, str(port)] + args
+    return [tool] + SSH_OPTS + [port_flag, str(port)] + auth + args
+
+
+def dvwa_target(cfg):
+    return f'{cfg.DVWA_USER}@{cfg.DVWA_HOST}'
+
+
+def dvwa_remote(cfg, path):
+    return f'{dvwa_target(cfg)}:{path}'
+
+
+def dvwa_ssh_cmd(cfg, remote_cmd):
+    return _with_auth(dvwa_ssh_auth(cfg), 'ssh', '-p', cfg.DVWA_SSH_PORT, [dvwa_target(cfg), remote_cmd])
+
+
+def scp_limit(cfg):
+    # scp takes its bandwidth cap in Kbit/s
+    if cfg.BACKUP_BWLIMIT_KBPS:
+        return ['-l', str(cfg.BACKUP_BWLIMIT_KBPS * 8)]
+    return []
+
+
+def dvwa_scp_cmd(cfg, *paths):
+    # paths: one or more sources followed by the destination
+    return _with_auth(dvwa_ssh_auth(cfg), 'scp', '-P', cfg.DVWA_SSH_PORT, scp_limit(cfg) + list(paths))
+
+
+# pfSense: password authentication only
+
+def pfsense_target(cfg):
+    return f'{cfg.PFSENSE_USER}@{cfg.PFSENSE_HOST}'
+
+
+def pfsense_remote(cfg, path):
+    return f'{pfsense_target(cfg)}:{path}'
+
+
+def pfsense_ssh_cmd(cfg, remote_cmd):
+    require_sshpass()
+    return ['sshpass', '-p', cfg.PFSENSE_PASSWORD, 'ssh'] + SSH_OPTS + [pfsense_target(cfg), remote_cmd]
+
+
+def pfsense_scp_cmd(cfg, src, dst):
+    require_sshpass()
+    return ['sshpass', '-p', cfg.PFSENSE_PASSWORD, 'scp'] + SSH_OPTS + scp_limit(cfg) + [src, dst]
+
+
+def run_main(module, argv=()):
+    # Runs a script's main() in this process; its sys.exit() is turned into a return code
+    try:
+        importlib.import_module(module).main(list(argv))
+    except SystemExit as e:
+        if e.code is None:
+            return 0
+        return e.code if isinstance(e.code, int) else 1
+    return 0
+
+
+def ensure_backup_dir(cfg):
+    os.makedirs(cfg.LOCAL_BACKUP_DIR, exist_ok=True)
+    return cfg.LOCAL_BACKUP_DIR
+
+
+def format_size(size):
+    for unit in ('B', 'K', 'M', 'G'):
+        if size < 1024 or unit == 'G':
+            return f"{size:.0f}{unit}" if unit == 'B' else f"{size:.1f}{unit}"
+        size /= 1024
+
+
+def get_downloaded_filename(folder, file_id):
+    # gdrive names the file as <file_id> if the original name is not available
+    for f in os.listdir(folder):
+        if file_id in f:
+            return os.path.join(folder, f)
+    # fallback: return the most recent file
+    files = [os.path.join(folder, f) for f in os.listdir(folder)]
+    if files:
+        return max(files, key=os.path.getctime)
+    return None
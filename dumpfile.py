@@ -0,0 +1,363 @@
+import argparse
+import json
+import os
+import re
+import sys
+import zlib
+from decimal import Decimal
+
+from common import format_size
+
+# Indexed dump format (.sql.gz)
+#
+# The file is a series of gzip members, so `gunzip -c dump.sql.gz | mysql` restores it as usual:
+#   - one or more members per section: the preamble ('') and then each table in dump order,
+#     split every FRAME_SIZE uncompressed bytes at a line boundary
+#   - an index member whose content is an SQL comment holding the JSON frame list
+#   - a fixed-size, uncompressed trailer member holding the index member's offset
+# Readers seek to the trailer, then the index, then decompress only the frames they need.
+
+FRAME_SIZE = 4 * 1024 * 1024
+READ_SIZE = 64 * 1024
+INDEX_VERSION = 1
+INDEX_PREFIX = b'-- dumpfile-index: '
+TRAILER_PREFIX = b'-- dumpfile-index-offset: '
+GZIP_WBITS = 31
+GZIP_MAGIC = b'\x1f\x8b'
+
+SECTION_RE = re.compile(
+    rb'^-- (?:Table structure|Temporary view structure|Final view structure) for (?:table|view) `((?:[^`]|``)+)`$'
+)
+COLUMN_RE = re.compile(r'^\s+`((?:[^`]|``)+)` ')
+INSERT_RE = re.compile(r'^INSERT INTO `(?:[^`]|``)+` (?:\(([^)]*)\) )?VALUES ')
+VALUE_RE = re.compile(
+    r"(?:_binary )?'((?:[^'\\]|\\.|'')*)'"
+    r"|(NULL)"
+    r"|0x([0-9A-Fa-f]*)"
+    r"|([-+]?[0-9][0-9.eE+-]*)",
+    re.S,
+)
+ESCAPE_RE = re.compile(r"\\(.)|''", re.S)
+ESCAPES = {'0': '\0', 'n': '\n', 'r': '\r', 't': '\t', 'b': '\b', 'Z': '\x1a'}
+
+
+def _gzip_member(data, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _trailer(index_offset):
+    # Stored (level 0) with a zero-padded offset, so every trailer has the same size
+    return _gzip_member(TRAILER_PREFIX + b'%020d\n' % index_offset, 0)
+
+
+TRAILER_SIZE = len(_trailer(0))
+
+
+def is_gzip(path):
+    with open(path, 'rb') as f:
+        return f.read(2) == GZIP_MAGIC
+
+
+def open_sql(path):
+    # Text stream over a plain .sql dump or a (possibly indexed) .sql.gz dump
+    if is_gzip(path):
+        import gzip
+        return gzip.open(path, 'rt', errors='replace')
+    return open(path, 'r', errors='replace')
+
+
+class DumpWriter:
+    # File-like sink for a mysqldump stream. Splits the SQL into per-table gzip members as it is
+    # written, so the dump is compressed and indexed without ever being held in memory.
+
+    def __init__(self, f, level=6):
+        self.f = f
+        self.level = level
+        self.frames = []
+        self.pos = 0
+        self._partial = b''
+        self._held = None
+        self._compressor = None
+        self._section = ''
+        self._frame_start = 0
+        self._frame_raw = 0
+
+    def write(self, data):
+        lines = (self._partial + data).split(b'\n')
+        self._partial = lines.pop()
+        for line in lines:
+            self._line(line + b'\n')
+        return len(data)
+
+    def _line(self, line):
+        # mysqldump puts a bare `--` line before each section marker; keep it with its section
+        if self._held is not None:
+            held, self._held = self._held, None
+            match = SECTION_RE.match(line.rstrip(b'\n'))
+            if match:
+                self._start_frame(match.group(1).replace(b'``', b'`').decode('utf-8', 'replace'))
+                self._emit(held)
+                self._emit(line)
+                return
+            self._line_in_frame(held)
+        if line == b'--\n':
+            self._held = line
+            return
+        self._line_in_frame(line)
+
+    def _line_in_frame(self, line):
+        match = SECTION_RE.match(line.rstrip(b'\n'))
+        if match:
+            self._start_frame(match.group(1).replace(b'``', b'`').decode('utf-8', 'replace'))
+        elif self._compressor is None or self._frame_raw >= FRAME_SIZE:
+            self._start_frame(self._section)
+        self._emit(line)
+
+    def _emit(self, data):
+        self._frame_raw += len(data)
+        self._out(self._compressor.compress(data))
+
+    def _out(self, data):
+        if data:
+            self.f.write(data)
+            self.pos += len(data)
+
+    def _start_frame(self, section):
+        self._end_frame()
+        self._section = section
+        self._compressor = zlib.compressobj(self.level, zlib.DEFLATED, GZIP_WBITS)
+        self._frame_start = self.pos
+        self._frame_raw = 0
+
+    def _end_frame(self):
+        if self._compressor is None:
+            return
+        self._out(self._compressor.flush())
+        self.frames.append([self._section, self._frame_start, self.pos - self._frame_start, self._frame_raw])
+        self._compressor = None
+
+    def close(self):
+        # Writes the last frame, the index and the trailer; the underlying file stays open
+        if self._held is not None:
+            self._line_in_frame(self._held)
+            self._held = None
+        if self._partial:
+            self._line_in_frame(self._partial)
+            self._partial = b''
+        self._end_frame()
+        index_offset = self.pos
+        index = json.dumps({'version': INDEX_VERSION, 'frames': self.frames}, separators=(',', ':'))
+        self._out(_gzip_member(INDEX_PREFIX + index.encode() + b'\n', self.level))
+        self._out(_trailer(index_offset))
+        self.f.flush()
+
+
+class DumpReader:
+    # Random access to an indexed dump: list tables and stream one table's SQL or rows.
+    # Only the frames of the requested table are read and decompressed.
+
+    def __init__(self, path):
+        self.path = path
+        self.f = open(path, 'rb')
+        try:
+            self.frames = self._read_index()
+        except Exception:
+            self.f.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.f.close()
+
+    def _read_index(self):
+        size = os.fstat(self.f.fileno()).st_size
+        if size < TRAILER_SIZE:
+            raise ValueError(f"{self.path} is not an indexed dump")
+        self.f.seek(size - TRAILER_SIZE)
+        try:
+            trailer = zlib.decompress(self.f.read(TRAILER_SIZE), GZIP_WBITS)
+        except zlib.error:
+            trailer = b''
+        if not trailer.startswith(TRAILER_PREFIX):
+            raise ValueError(f"{self.path} is not an indexed dump")
+        index_offset = int(trailer[len(TRAILER_PREFIX):])
+
+        self.f.seek(index_offset)
+        index = zlib.decompress(self.f.read(size - TRAILER_SIZE - index_offset), GZIP_WBITS)
+        index = json.loads(index[len(INDEX_PREFIX):])
+        if index['version'] != INDEX_VERSION:
+            raise ValueError(f"{self.path} has unsupported index version {index['version']}")
+        return [tuple(frame) for frame in index['frames']]
+
+    def raw_size(self):
+        # Uncompressed size of the whole dump
+        return sum(raw_size for _, _, _, raw_size in self.frames)
+
+    def tables(self):
+        # name -> (compressed bytes, uncompressed bytes), in dump order
+        sizes = {}
+        for section, _, length, raw_size in self.frames:
+            if section:
+                compressed, raw = sizes.get(section, (0, 0))
+                sizes[section] = (compressed + length, raw + raw_size)
+        return sizes
+
+    def iter_bytes(self, section):
+        for frame_section, offset, length, _ in self.frames:
+            if frame_section != section:
+                continue
+            decompressor = zlib.decompressobj(GZIP_WBITS)
+            self.f.seek(offset)
+            remaining = length
+            while remaining:
+                chunk = self.f.read(min(READ_SIZE, remaining))
+                if not chunk:
+                    raise ValueError(f"{self.path} is truncated")
+                remaining -= len(chunk)
+                yield decompressor.decompress(chunk)
+            yield decompressor.flush()
+
+    def iter_lines(self, section):
+        # '' is the preamble (session settings, binlog coordinates)
+        partial = b''
+        for chunk in self.iter_bytes(section):
+            lines = (partial + chunk).split(b'\n')
+            partial = lines.pop()
+            for line in lines:
+                yield line.decode('utf-8', 'surrogateescape')
+        if partial:
+            yield partial.decode('utf-8', 'surrogateescape')
+
+    def columns(self, table):
+        columns = []
+        in_create = False
+        for line in self.iter_lines(table):
+            if line.startswith('CREATE TABLE '):
+                in_create = True
+            elif in_create:
+                match = COLUMN_RE.match(line)
+                if match:
+                    columns.append(match.group(1).replace('``', '`'))
+                else:
+                    break
+        return columns
+
+    def rows(self, table):
+        # Yields one dict per row, parsed from the table's INSERT statements
+        columns = self.columns(table)
+        for line in self.iter_lines(table):
+            match = INSERT_RE.match(line)
+            if not match:
+                continue
+            names = columns
+            if match.group(1):
+                names = [name.strip().strip('`').replace('``', '`') for name in match.group(1).split(',')]
+            for values in parse_values(line, match.end()):
+                yield dict(zip(names, values))
+
+
+def _unescape(text):
+    return ESCAPE_RE.sub(lambda m: "'" if m.group(1) is None else ESCAPES.get(m.group(1), m.group(1)), text)
+
+
+def _number(text):
+    if '.' not in text and 'e' not in text.lower():
+        return int(text)
+    if 'e' in text.lower():
+        return float(text)
+    return Decimal(text)
+
+
+def parse_values(text, pos=0):
+    # Yields one tuple per row of an extended INSERT's `(...),(...);` list, starting at pos
+    n = len(text)
+    while pos < n:
+        if text[pos] != '(':
+            pos += 1
+            continue
+        pos += 1
+        row = []
+        while True:
+            match = VALUE_RE.match(text, pos)
+            if not match:
+                raise ValueError(f"Cannot parse INSERT value near: {text[pos:pos + 40]!r}")
+            string, null, hex_digits, number = match.groups()
+            if string is not None:
+                row.append(_unescape(string))
+            elif null:
+                row.append(None)
+            elif hex_digits is not None:
+                row.append(bytes.fromhex(hex_digits))
+            else:
+                row.append(_number(number))
+            pos = match.end()
+            if pos < n and text[pos] == ',':
+                pos += 1
+                continue
+            if pos < n and text[pos] == ')':
+                pos += 1
+                break
+            raise ValueError(f"Cannot parse INSERT value near: {text[pos:pos + 40]!r}")
+        yield tuple(row)
+
+
+def _cell(value):
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bytes):
+        return '0x' + value.hex()
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect an indexed DVWA database dump (.sql.gz)")
+    parser.add_argument('dump', help="dump file")
+    parser.add_argument('--table', help="print this table's rows (tab-separated)")
+    parser.add_argument('--sql', action='store_true', help="with --table, print its SQL instead of rows")
+    parser.add_argument('--limit', type=int, default=0, help="print at most N rows")
+    args = parser.parse_args(argv)
+
+    if not os.path.isfile(args.dump):
+        print(f"Dump not found: {args.dump}")
+        sys.exit(1)
+    try:
+        reader = DumpReader(args.dump)
+    except (ValueError, zlib.error) as e:
+        print(f"Cannot read dump index: {e}")
+        print("Plain or older dumps can be inspected with `gunzip -c` or a text viewer.")
+        sys.exit(1)
+
+    with reader:
+        tables = reader.tables()
+        if not args.table:
+            print(f"{len(tables)} table(s) in {args.dump}:")
+            for name, (compressed, raw) in tables.items():
+                print(f"  {format_size(raw):>8} ({format_size(compressed):>8} compressed)  {name}")
+            return
+
+        if args.table not in tables:
+            print(f"Table '{args.table}' is not in this dump.")
+            sys.exit(1)
+        if args.sql:
+            for line in reader.iter_lines(args.table):
+                print(line)
+            return
+
+        header_printed = False
+        for count, row in enumerate(reader.rows(args.table), 1):
+            if not header_printed:
+                print('\t'.join(row))
+                header_printed = True
+            print('\t'.join(_cell(value) for value in row.values()))
+            if args.limit and count >= args.limit:
+                break
+
+
+if __name__ == '__main__':
+    main()
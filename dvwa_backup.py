@@ -1,177 +1,136 @@
 import os
 import subprocess
-import sys
+import threading
 from datetime import datetime
-from pathlib import Path
-
-from dotenv import load_dotenv
-
-# Load environment variables from .env
-load_dotenv()
-
-DVWA_HOST = os.getenv('DVWA_HOST')
-DVWA_USER = os.getenv('DVWA_USER')
-DVWA_PASSWORD = os.getenv('DVWA_PASSWORD')
-DVWA_SSH_PORT = os.getenv('DVWA_SSH_PORT', '2222')
-DVWA_SSH_KEY = os.getenv('DVWA_SSH_KEY')
-DVWA_WEB_PATH = os.getenv('DVWA_WEB_PATH', '/var/www/html')
-DVWA_DB_NAME = os.getenv('DVWA_DB_NAME', 'dvwa')
-DVWA_DB_USER = os.getenv('DVWA_DB_USER', 'root')
-DVWA_DB_PASSWORD = os.getenv('DVWA_DB_PASSWORD')
-LOCAL_BACKUP_DIR = os.getenv('LOCAL_BACKUP_DIR')
-GDRIVE_FOLDER_ID = os.getenv('GDRIVE_FOLDER_ID')
-
-# Check required env vars
-required_vars = [
-    'DVWA_HOST', 'DVWA_USER', 'DVWA_DB_PASSWORD',
-    'LOCAL_BACKUP_DIR', 'GDRIVE_FOLDER_ID'
-]
-for var in required_vars:
-    if not os.getenv(var):
-        print(f"Missing required env var: {var}")
-        sys.exit(1)
-
-# Ensure local backup directory exists
-Path(LOCAL_BACKUP_DIR).mkdir(parents=True, exist_ok=True)
-
-# Generate backup filename
-date_str = datetime.now().strftime('%Y-%m-%d')
-source_backup_file = f"dvwa_source_backup_{date_str}.tar.gz"
-db_backup_file = f"dvwa_db_backup_{date_str}.sql"
-local_source_backup = os.path.join(LOCAL_BACKUP_DIR, source_backup_file)
-local_db_backup = os.path.join(LOCAL_BACKUP_DIR, db_backup_file)
-
-# Determine SSH authentication method
-ssh_auth = []
-if DVWA_SSH_KEY and os.path.exists(os.path.expanduser(DVWA_SSH_KEY)):
-    ssh_auth = ['-i', os.path.expanduser(DVWA_SSH_KEY)]
-elif DVWA_PASSWORD:
-    # Check for sshpass
-    if subprocess.call(['which', 'sshpass'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) != 0:
-        print("sshpass is required for password authentication. Please install it (e.g., brew install hudochenkov/sshpass/sshpass).")
-        sys.exit(1)
-    ssh_auth = ['sshpass', '-p', DVWA_PASSWORD]
-else:
-    print("Either DVWA_SSH_KEY or DVWA_PASSWORD must be provided.")
-    sys.exit(1)
-
-print(f"Backing up DVWA from {DVWA_HOST}...")
-
-# Step 1: Create source backup on remote server
-print("Creating source code backup on remote server...")
-remote_source_backup = f"/root/{source_backup_file}"
-tar_cmd = f"cd {DVWA_WEB_PATH} && tar -czvf {remote_source_backup} dvwa/ && ls -lh {remote_source_backup}"
-
-if ssh_auth[0] == 'sshpass':
-    ssh_cmd = ssh_auth + [
-        'ssh', '-o', 'StrictHostKeyChecking=no', '-p', DVWA_SSH_PORT,
-        f'{DVWA_USER}@{DVWA_HOST}',
-        tar_cmd
-    ]
-else:
-    ssh_cmd = [
-        'ssh', '-o', 'StrictHostKeyChecking=no', '-p', DVWA_SSH_PORT
-    ] + ssh_auth + [
-        f'{DVWA_USER}@{DVWA_HOST}',
-        tar_cmd
-    ]
-
-result = subprocess.run(ssh_cmd)
-if result.returncode != 0:
-    print("Failed to create source backup on remote server.")
-    sys.exit(1)
-
-# Step 2: Create database backup on remote server
-print("Creating database backup on remote server...")
-remote_db_backup = f"/root/{db_backup_file}"
-mysqldump_cmd = f"mysqldump -u {DVWA_DB_USER} -p'{DVWA_DB_PASSWORD}' {DVWA_DB_NAME} > {remote_db_backup} && ls -lh {remote_db_backup}"
-
-if ssh_auth[0] == 'sshpass':
-    ssh_cmd = ssh_auth + [
-        'ssh', '-o', 'StrictHostKeyChecking=no', '-p', DVWA_SSH_PORT,
-        f'{DVWA_USER}@{DVWA_HOST}',
-        mysqldump_cmd
-    ]
-else:
-    ssh_cmd = [
-        'ssh', '-o', 'StrictHostKeyChecking=no', '-p', DVWA_SSH_PORT
-    ] + ssh_auth + [
-        f'{DVWA_USER}@{DVWA_HOST}',
-        mysqldump_cmd
-    ]
-
-result = subprocess.run(ssh_cmd)
-if result.returncode != 0:
-    print("Failed to create database backup on remote server.")
-    sys.exit(1)
-
-# Step 3: Download source backup from remote server
-print(f"Downloading source backup to {local_source_backup}...")
-if ssh_auth[0] == 'sshpass':
-    scp_cmd = ssh_auth + [
-        'scp', '-o', 'StrictHostKeyChecking=no', '-P', DVWA_SSH_PORT,
-        f'{DVWA_USER}@{DVWA_HOST}:{remote_source_backup}',
-        local_source_backup
-    ]
-else:
-    scp_cmd = [
-        'scp', '-o', 'StrictHostKeyChecking=no', '-P', DVWA_SSH_PORT
-    ] + ssh_auth + [
-        f'{DVWA_USER}@{DVWA_HOST}:{remote_source_backup}',
-        local_source_backup
-    ]
-
-result = subprocess.run(scp_cmd)
-if result.returncode != 0:
-    print("Failed to download source backup from remote server.")
-    sys.exit(1)
-
-print(f"Source backup downloaded to {local_source_backup}")
-
-# Step 4: Download database backup from remote server
-print(f"Downloading database backup to {local_db_backup}...")
-if ssh_auth[0] == 'sshpass':
-    scp_cmd = ssh_auth + [
-        'scp', '-o', 'StrictHostKeyChecking=no', '-P', DVWA_SSH_PORT,
-        f'{DVWA_USER}@{DVWA_HOST}:{remote_db_backup}',
-        local_db_backup
-    ]
-else:
-    scp_cmd = [
-        'scp', '-o', 'StrictHostKeyChecking=no', '-P', DVWA_SSH_PORT
-    ] + ssh_auth + [
-        f'{DVWA_USER}@{DVWA_HOST}:{remote_db_backup}',
-        local_db_backup
-    ]
-
-result = subprocess.run(scp_cmd)
-if result.returncode != 0:
-    print("Failed to download database backup from remote server.")
-    sys.exit(1)
-
-print(f"Database backup downloaded to {local_db_backup}")
-
-# Step 5: Upload source backup to Google Drive
-print(f"Uploading source backup to Google Drive folder {GDRIVE_FOLDER_ID}...")
-gdrive_cmd = [
-    'gdrive', 'files', 'upload', '--parent', GDRIVE_FOLDER_ID, local_source_backup
-]
-result = subprocess.run(gdrive_cmd)
-if result.returncode != 0:
-    print("Failed to upload source backup to Google Drive.")
-    sys.exit(1)
-
-print("Source backup uploaded to Google Drive successfully.")
-
-# Step 6: Upload database backup to Google Drive
-print(f"Uploading database backup to Google Drive folder {GDRIVE_FOLDER_ID}...")
-gdrive_cmd = [
-    'gdrive', 'files', 'upload', '--parent', GDRIVE_FOLDER_ID, local_db_backup
-]
-result = subprocess.run(gdrive_cmd)
-if result.returncode == 0:
-    print("Database backup uploaded to Google Drive successfully.")
+
+from common import dvwa_ssh_cmd, ensure_backup_dir, load_config, require
+from dumpfile import DumpReader, DumpWriter
+from run_history import RunRecorder
+from throttle import LoadGovernor, RateLimiter, copy_stream, low_priority
+from upload_spool import ship
+
+
+def mysqldump_cmd(cfg):
+    opts = []
+    if cfg.DVWA_DUMP_CONSISTENT:
+        # One InnoDB snapshot instead of table locks, and rows streamed instead of buffered in the client
+        opts += ['--single-transaction', '--quick']
+    if cfg.DVWA_DUMP_BINLOG_COORDS:
+        # Records the binlog file/position of the snapshot as a comment in the dump header
+        opts += ['--master-data=2']
+    opts_str = ' '.join(opts) + ' ' if opts else ''
+    return f"mysqldump {opts_str}-u {cfg.DVWA_DB_USER} -p'{cfg.DVWA_DB_PASSWORD}' {cfg.DVWA_DB_NAME}"
+
+
+def start_capture(cfg, cmd, local_path, governor, indexed=False):
+    # Streams a remote command's stdout into a .part file next to local_path.
+    # governor: None copies at full speed, without bandwidth cap or load pauses
+    # indexed: compress a SQL stream into the per-table indexed format (see dumpfile.py)
+    part_path = f"{local_path}.part"
+    out = open(part_path, 'wb')
+    sink = DumpWriter(out) if indexed else out
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    errors = []
+
+    def pump():
+        try:
+            limiter = RateLimiter.from_config(cfg) if governor is not None else None
+            copy_stream(proc.stdout, sink, limiter, governor)
+            if indexed:
+                sink.close()
+        except OSError as e:
+            errors.append(e)
+            proc.kill()
+
+    thread = threading.Thread(target=pump)
+    thread.start()
+    return proc, thread, out, part_path, errors
+
+
+def finish_capture(capture, local_path):
+    proc, thread, out, part_path, errors = capture
+    thread.join()
+    proc.stdout.close()
+    returncode = proc.wait()
+    out.close()
+    if errors:
+        print(f"Failed to write {part_path}: {errors[0]}")
+        returncode = returncode or 1
+    if returncode == 0:
+        os.replace(part_path, local_path)
+    else:
+        # Never leave a truncated archive or dump behind
+        os.remove(part_path)
+    return returncode
+
+
+def backup(cfg, run):
+    # Generate backup filename
+    date_str = datetime.now().strftime('%Y%m%d_%H%M%S')
+    source_backup_file = f"dvwa_source_backup_{date_str}.tar.gz"
+    db_backup_file = f"dvwa_db_backup_{date_str}.sql{'.gz' if cfg.DVWA_DUMP_COMPRESS else ''}"
+    local_source_backup = os.path.join(cfg.LOCAL_BACKUP_DIR, source_backup_file)
+    local_db_backup = os.path.join(cfg.LOCAL_BACKUP_DIR, db_backup_file)
+
+    print(f"Backing up DVWA from {cfg.DVWA_HOST}...")
+
+    # Steps 1-2: Stream source archive and database dump straight into LOCAL_BACKUP_DIR
+    tar_cmd = dvwa_ssh_cmd(cfg, low_priority(cfg, f"cd {cfg.DVWA_WEB_PATH} && tar -czf - dvwa/"))
+    dump_cmd = dvwa_ssh_cmd(cfg, low_priority(cfg, mysqldump_cmd(cfg)))
+    with run.step('capture'), LoadGovernor(cfg) as governor:
+        if cfg.DVWA_DUMP_CONSISTENT:
+            # Both captures start together so the archive and the dump describe the same moment
+            print(f"Capturing database and source code together at {datetime.now():%H:%M:%S}...")
+            db_capture = start_capture(cfg, dump_cmd, local_db_backup, governor, cfg.DVWA_DUMP_COMPRESS)
+            source_capture = start_capture(cfg, tar_cmd, local_source_backup, governor)
+            db_result = finish_capture(db_capture, local_db_backup)
+            source_result = finish_capture(source_capture, local_source_backup)
+        else:
+            print("Creating source code backup...")
+            source_result = finish_capture(start_capture(cfg, tar_cmd, local_source_backup, governor), local_source_backup)
+            print("Creating database backup...")
+            # Without --single-transaction mysqldump holds LOCK TABLES until it is read to the end,
+            # so slowing it down would stall DVWA's writes; only the source archive is throttled
+            db_capture = start_capture(cfg, dump_cmd, local_db_backup, None, cfg.DVWA_DUMP_COMPRESS)
+            db_result = finish_capture(db_capture, local_db_backup)
+    if governor.paused_for:
+        print(f"Transfers were paused for {governor.paused_for:.0f}s because the target was busy.")
+        run.paused('capture', governor.paused_for)
+
+    if source_result != 0:
+        run.fail("Failed to create source backup on remote server.")
+    print(f"Source backup downloaded to {local_source_backup} ({os.path.getsize(local_source_backup)} bytes)")
+    run.artifact('dvwa-source', local_source_backup)
+
+    if db_result != 0:
+        run.fail("Failed to create database backup on remote server.")
+    print(f"Database backup downloaded to {local_db_backup} ({os.path.getsize(local_db_backup)} bytes)")
+    if cfg.DVWA_DUMP_COMPRESS:
+        with DumpReader(local_db_backup) as reader:
+            run.artifact('dvwa-db', local_db_backup, reader.raw_size())
+    else:
+        run.artifact('dvwa-db', local_db_backup)
+
+    # Step 3: Hand both files to the upload spool; see upload_spool.py
+    with run.step('upload'):
+        shipped = ship(cfg, [local_source_backup, local_db_backup])
+    if shipped != 0:
+        run.fail("Failed to upload backups to Google Drive. They stay queued for the upload worker.")
+
     print("\nBackup completed successfully!")
-else:
-    print("Failed to upload database backup to Google Drive.")
-    sys.exit(1)
+
+
+def main(argv=None):
+    cfg = load_config()
+    require(cfg, 'DVWA_HOST', 'DVWA_USER', 'DVWA_DB_PASSWORD', 'LOCAL_BACKUP_DIR', 'GDRIVE_FOLDER_ID')
+
+    # Ensure local backup directory exists
+    ensure_backup_dir(cfg)
+
+    # Sizes, step durations and the outcome are recorded in the run history; see run_history.py
+    with RunRecorder(cfg, 'dvwa', cfg.DVWA_HOST) as run:
+        backup(cfg, run)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+import argparse
+import hashlib
+import os
+import re
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from common import dvwa_ssh_cmd, ensure_backup_dir, load_config, require
+from dumpfile import open_sql
+from throttle import RateLimiter, copy_stream, low_priority
+
+# Local binlog segments live next to the full dumps
+BINLOG_SUBDIR = 'dvwa_binlogs'
+# Segments from an earlier log history are moved into <BINLOG_SUBDIR>/replaced-<timestamp>/
+REPLACED_PREFIX = 'replaced-'
+SEGMENT_RE = re.compile(r'^(?P<base>.+)\.(?P<num>\d+)$')
+# Leading bytes compared to tell a continued segment from a new one with the same name; they hold
+# the format description event, which records the server version and the segment's creation time
+HEAD_CHECK_BYTES = 4096
+
+# Written by mysqldump --master-data=2 (MySQL < 8.0.26 and MariaDB) or --source-data=2
+COORDS_RE = re.compile(
+    r"CHANGE (?:MASTER|REPLICATION SOURCE) TO (?:MASTER|SOURCE)_LOG_FILE='(?P<file>[^']+)',\s*"
+    r"(?:MASTER|SOURCE)_LOG_POS=(?P<pos>\d+)"
+)
+
+
+def binlog_dir(cfg):
+    return os.path.join(cfg.LOCAL_BACKUP_DIR, BINLOG_SUBDIR)
+
+
+def mysql_query(cfg, sql):
+    # Returns rows as lists of strings (tab-separated batch output)
+    mysql_cmd = f"mysql -u {cfg.DVWA_DB_USER} -p'{cfg.DVWA_DB_PASSWORD}' -sN -e \"{sql}\""
+    result = subprocess.run(dvwa_ssh_cmd(cfg, mysql_cmd), capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"Query failed: {sql}")
+        print(result.stderr.strip())
+        sys.exit(1)
+    return [line.split('\t') for line in result.stdout.splitlines() if line]
+
+
+def list_remote_binlogs(cfg):
+    # Returns (directory, [(segment name, size)]) in server order
+    rows = mysql_query(cfg, "SELECT @@log_bin, @@log_bin_basename")
+    if not rows or rows[0][0] not in ('1', 'ON'):
+        print("Binary logging is disabled on the DVWA MySQL server (enable log_bin).")
+        sys.exit(1)
+    remote_dir = os.path.dirname(rows[0][1])
+    segments = [(row[0], int(row[1])) for row in mysql_query(cfg, "SHOW BINARY LOGS")]
+    return remote_dir, segments
+
+
+def _head_hash(path, length):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read(length)).hexdigest()
+
+
+def remote_head_hashes(cfg, remote_dir, lengths):
+    # {segment name: sha256 of its first n bytes} for {segment name: n}, in one round trip
+    names = list(lengths)
+    hash_cmd = '; '.join(f"head -c {lengths[name]} {remote_dir}/{name} | sha256sum" for name in names)
+    result = subprocess.run(dvwa_ssh_cmd(cfg, hash_cmd), capture_output=True, text=True)
+    hashes = [line.split()[0] for line in result.stdout.splitlines() if line]
+    if result.returncode != 0 or len(hashes) != len(names):
+        print("Failed to check binlog segments on remote server.")
+        sys.exit(1)
+    return dict(zip(names, hashes))
+
+
+def retire_stale_segments(cfg, local_dir, remote_dir, segments):
+    # After RESET MASTER, a server rebuild or a reused name, a local segment no longer continues the
+    # server's file of the same name. Appending to it would splice two histories, and replay would
+    # apply the old one, so such segments are moved aside and shipped again from the start.
+    local_sizes = {
+        name: os.path.getsize(os.path.join(local_dir, name))
+        for name, _ in segments if os.path.isfile(os.path.join(local_dir, name))
+    }
+    stale = [name for name, remote_size in segments if local_sizes.get(name, 0) > remote_size]
+    lengths = {
+        name: min(local_sizes[name], HEAD_CHECK_BYTES)
+        for name, _ in segments if local_sizes.get(name) and name not in stale
+    }
+    if lengths:
+        remote_hashes = remote_head_hashes(cfg, remote_dir, lengths)
+        stale += [
+            name for name, length in lengths.items()
+            if _head_hash(os.path.join(local_dir, name), length) != remote_hashes[name]
+        ]
+    if not stale:
+        return
+
+    # Local segments numbered past the server's newest one belong to the old history as well
+    newest = SEGMENT_RE.match(segments[-1][0])
+    if newest:
+        for name in os.listdir(local_dir):
+            match = SEGMENT_RE.match(name)
+            if (match and match.group('base') == newest.group('base')
+                    and int(match.group('num')) > int(newest.group('num'))):
+                stale.append(name)
+
+    replaced_dir = os.path.join(local_dir, f"{REPLACED_PREFIX}{datetime.now():%Y%m%d_%H%M%S}")
+    os.makedirs(replaced_dir, exist_ok=True)
+    for name in stale:
+        os.replace(os.path.join(local_dir, name), os.path.join(replaced_dir, name))
+    print(f"The server's binlog history changed (RESET MASTER or rebuild?). "
+          f"Moved {len(stale)} old segment(s) to {replaced_dir}.")
+
+
+def ship_once(cfg, rotate=False):
+    # Pulls every byte the server has that we don't; returns bytes shipped
+    local_dir = binlog_dir(cfg)
+    os.makedirs(local_dir, exist_ok=True)
+
+    if rotate:
+        # Closes the active segment so everything up to now is in a finished file
+        mysql_query(cfg, "FLUSH BINARY LOGS")
+
+    remote_dir, segments = list_remote_binlogs(cfg)
+    if segments:
+        retire_stale_segments(cfg, local_dir, remote_dir, segments)
+    shipped = 0
+    for name, remote_size in segments:
+        local_path = os.path.join(local_dir, name)
+        local_size = os.path.getsize(local_path) if os.path.exists(local_path) else 0
+        if local_size == remote_size:
+            continue
+
+        # Only the missing tail is transferred; the active segment is shipped incrementally
+        wanted = remote_size - local_size
+        fetch_cmd = low_priority(cfg, f"tail -c +{local_size + 1} {remote_dir}/{name} | head -c {wanted}")
+        with open(local_path, 'ab') as out:
+            proc = subprocess.Popen(dvwa_ssh_cmd(cfg, fetch_cmd), stdout=subprocess.PIPE)
+            copy_stream(proc.stdout, out, RateLimiter.from_config(cfg))
+            proc.stdout.close()
+            returncode = proc.wait()
+        if returncode != 0 or os.path.getsize(local_path) != remote_size:
+            # Drop a partial append so the next run resumes from a known offset
+            with open(local_path, 'ab') as out:
+                out.truncate(local_size)
+            print(f"Failed to ship {name} (offset {local_size}).")
+            sys.exit(1)
+
+        print(f"Shipped {name}: {local_size} -> {remote_size} bytes")
+        shipped += wanted
+    return shipped
+
+
+def read_dump_coords(dump_path):
+    # Binlog coordinates are in the first lines of a dump taken with DVWA_DUMP_BINLOG_COORDS=1
+    with open_sql(dump_path) as f:
+        for _, line in zip(range(200), f):
+            match = COORDS_RE.search(line)
+            if match:
+                return match.group('file'), int(match.group('pos'))
+    return None
+
+
+def segments_from(cfg, start_file):
+    # Local segments needed to roll forward from start_file, oldest first. A gap in the numbering
+    # would silently skip the missing segment's events, so it is an error.
+    local_dir = binlog_dir(cfg)
+    start = SEGMENT_RE.match(start_file)
+    if not start or not os.path.isdir(local_dir):
+        return []
+    numbered = []
+    for name in os.listdir(local_dir):
+        match = SEGMENT_RE.match(name)
+        if (match and match.group('base') == start.group('base')
+                and int(match.group('num')) >= int(start.group('num'))):
+            numbered.append((int(match.group('num')), name))
+    numbered.sort()
+    for (num, name), (next_num, next_name) in zip(numbered, numbered[1:]):
+        if next_num != num + 1:
+            print(f"Binlog segment(s) between {name} and {next_name} have not been shipped. "
+                  f"Replay cannot skip them.")
+            sys.exit(1)
+    return [os.path.join(local_dir, name) for _, name in numbered]
+
+
+def parse_until(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected 'YYYY-MM-DD HH:MM:SS'")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ship DVWA MySQL binary logs into LOCAL_BACKUP_DIR")
+    parser.add_argument('--watch', action='store_true', help="keep shipping every --interval seconds")
+    parser.add_argument('--interval', type=int, default=60, help="seconds between polls with --watch (default: 60)")
+    parser.add_argument('--rotate', action='store_true', help="run FLUSH BINARY LOGS before shipping")
+    args = parser.parse_args(argv)
+
+    cfg = load_config()
+    require(cfg, 'DVWA_HOST', 'DVWA_USER', 'DVWA_DB_PASSWORD', 'LOCAL_BACKUP_DIR')
+    ensure_backup_dir(cfg)
+
+    print(f"Shipping binary logs from {cfg.DVWA_HOST} to {binlog_dir(cfg)}...")
+    if not args.watch:
+        shipped = ship_once(cfg, rotate=args.rotate)
+        print(f"Binlog shipping completed ({shipped} new bytes).")
+        return
+
+    try:
+        while True:
+            try:
+                ship_once(cfg, rotate=args.rotate)
+            except SystemExit:
+                # A dropped connection must not end continuous shipping
+                print(f"Retrying in {args.interval}s...")
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        print("\nStopped.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+import atexit
+import queue
+import socket
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from functools import lru_cache
+from typing import Optional
+
+from common import SSH_OPTS, dvwa_ssh_auth, dvwa_target
+
+TUNNEL_TIMEOUT = 10
+# ssh exits when the server stops answering for TUNNEL_KEEPALIVE * 3 seconds, so a dead forward is
+# noticed (and reopened by the pool) instead of hanging
+TUNNEL_KEEPALIVE = 15
+
+USER_COLUMNS = 'user_id, first_name, last_name, user, avatar, last_login, failed_login'
+
+
+@dataclass
+class DvwaUser:
+    user_id: int
+    first_name: str
+    last_name: str
+    user: str
+    avatar: str
+    last_login: Optional[datetime]
+    failed_login: int
+
+
+class SSHTunnel:
+    # One `ssh -N -L` forward to the DVWA MySQL server, shared by every pooled connection
+
+    def __init__(self, cfg):
+        self.cfg = cfg
+        self.proc = None
+        self.local_port = None
+
+    def open(self):
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            self.local_port = s.getsockname()[1]
+
+        forward = f'127.0.0.1:{self.local_port}:{self.cfg.DVWA_DB_HOST}:{self.cfg.DVWA_DB_PORT}'
+        args = SSH_OPTS + [
+            '-o', 'ExitOnForwardFailure=yes',
+            '-o', f'ServerAliveInterval={TUNNEL_KEEPALIVE}', '-o', 'ServerAliveCountMax=3',
+            '-N', '-L', forward, '-p', str(self.cfg.DVWA_SSH_PORT),
+        ]
+        auth = list(dvwa_ssh_auth(self.cfg))
+        if auth[0] == 'sshpass':
+            cmd = auth + ['ssh'] + args + [dvwa_target(self.cfg)]
+        else:
+            cmd = ['ssh'] + args + auth + [dvwa_target(self.cfg)]
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL)
+
+        deadline = time.monotonic() + TUNNEL_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.proc.poll() is not None:
+                break
+            try:
+                socket.create_connection(('127.0.0.1', self.local_port), timeout=1).close()
+                return self
+            except OSError:
+                time.sleep(0.1)
+        self.close()
+        print(f"Failed to open SSH tunnel to {self.cfg.DVWA_HOST}.")
+        sys.exit(1)
+
+    def close(self):
+        if self.proc and self.proc.poll() is None:
+            self.proc.terminate()
+            self.proc.wait()
+
+    def alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+
+class ConnectionPool:
+    # Keeps up to `size` open MySQL connections through the tunnel and hands them out per operation
+
+    def __init__(self, cfg, size):
+        try:
+            import pymysql
+        except ImportError:
+            print("PyMySQL is required for database access. Please install it (e.g., pip install pymysql).")
+            sys.exit(1)
+        self._pymysql = pymysql
+        self.cfg = cfg
+        self.size = size
+        self.tunnel = SSHTunnel(cfg).open()
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        # Bumped whenever the tunnel is reopened; connections from an older tunnel are discarded
+        self._generation = 0
+
+    def _check_tunnel(self):
+        # The tunnel lives as long as the process; if ssh exited (network blip, server restart),
+        # every connection through it is dead, so start over with a new tunnel
+        with self._lock:
+            if self.tunnel.alive():
+                return
+            print(f"SSH tunnel to {self.cfg.DVWA_HOST} closed, reopening...")
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                except queue.Empty:
+                    break
+            self._created = 0
+            self._generation += 1
+            self.tunnel.open()
+
+    def _connect(self):
+        conn = self._pymysql.connect(
+            host='127.0.0.1',
+            port=self.tunnel.local_port,
+            user=self.cfg.DVWA_DB_USER,
+            password=self.cfg.DVWA_DB_PASSWORD,
+            database=self.cfg.DVWA_DB_NAME,
+            charset='utf8mb4',
+            cursorclass=self._pymysql.cursors.DictCursor,
+            autocommit=True,
+        )
+        conn.pool_generation = self._generation
+        return conn
+
+    def _acquire(self):
+        self._check_tunnel()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return self._connect()
+                except Exception:
+                    self._created -= 1
+                    raise
+        return self._idle.get()
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            conn.ping(reconnect=True)
+            yield conn
+        except Exception:
+            # A connection that failed mid-operation is not trusted again
+            self._discard(conn)
+            raise
+        else:
+            if conn.pool_generation == self._generation:
+                self._idle.put(conn)
+            else:
+                conn.close()
+
+    def _discard(self, conn):
+        with self._lock:
+            if conn.pool_generation == self._generation:
+                self._created -= 1
+        conn.close()
+
+    @contextmanager
+    def transaction(self):
+        with self.connection() as conn:
+            conn.begin()
+            try:
+                yield conn
+            except Exception:
+                conn.rollback()
+                raise
+            conn.commit()
+
+    def query(self, sql, params=()):
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute(sql, params)
+            return cur.fetchall()
+
+    def execute(self, sql, params=()):
+        with self.connection() as conn, conn.cursor() as cur:
+            return cur.execute(sql, params)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        self.tunnel.close()
+
+
+@lru_cache(maxsize=None)
+def get_pool(cfg):
+    # One pool per process; a long-running backupctl shell reuses the tunnel and connections
+    pool = ConnectionPool(cfg, cfg.DVWA_DB_POOL_SIZE)
+    atexit.register(pool.close)
+    return pool
+
+
+def list_users(pool):
+    return [DvwaUser(**row) for row in pool.query(f"SELECT {USER_COLUMNS} FROM users ORDER BY user_id")]
+
+
+def find_user(pool, username):
+    rows = pool.query(f"SELECT {USER_COLUMNS} FROM users WHERE user = %s", (username,))
+    return DvwaUser(**rows[0]) if rows else None
+
+
+def add_user(pool, first_name, last_name, username, password_hash, avatar):
+    # Allocates the next user_id and inserts in one transaction; returns the new user_id
+    with pool.transaction() as conn, conn.cursor() as cur:
+        cur.execute("SELECT COALESCE(MAX(user_id), 0) + 1 AS next_id FROM users FOR UPDATE")
+        user_id = int(cur.fetchone()['next_id'])
+        cur.execute(
+            "INSERT INTO users (user_id, first_name, last_name, user, password, avatar, failed_login) "
+            "VALUES (%s, %s, %s, %s, %s, %s, 0)",
+            (user_id, first_name, last_name, username, password_hash, avatar),
+        )
+    return user_id
+
+
+def delete_user(pool, username):
+    # Returns the number of rows deleted
+    return pool.execute("DELETE FROM users WHERE user = %s", (username,))
+
+
+def format_users(users):
+    headers = ['ID', 'First Name', 'Last Name', 'Username', 'Avatar', 'Last Login', 'Failed Logins']
+    rows = [
+        [str(u.user_id), u.first_name or '', u.last_name or '', u.user, u.avatar or '',
+         u.last_login.strftime('%Y-%m-%d %H:%M:%S') if u.last_login else '', str(u.failed_login)]
+        for u in users
+    ]
+    widths = [max(len(cell) for cell in column) for column in zip(headers, *rows)]
+    line = '+' + '+'.join('-' * (w + 2) for w in widths) + '+'
+
+    def fmt(cells):
+        return '| ' + ' | '.join(cell.ljust(w) for cell, w in zip(cells, widths)) + ' |'
+
+    return '\n'.join([line, fmt(headers), line] + [fmt(r) for r in rows] + [line])
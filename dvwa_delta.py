@@ -0,0 +1,122 @@
+import hashlib
+import io
+import posixpath
+import shlex
+import subprocess
+import tarfile
+import tempfile
+
+from common import dvwa_ssh_cmd
+
+# Top-level directory inside dvwa_source_backup_*.tar.gz, relative to DVWA_WEB_PATH
+SOURCE_ROOT = 'dvwa'
+# Staging directory, created in DVWA_STAGE_PATH; outside the web root so it is never served,
+# but on the same filesystem as the live tree for hardlinks and the exchange rename
+STAGE_DIR = '.dvwa-restore'
+DELETE_LIST = '.delete-list'
+# Fallback for servers whose mv has no --exchange (coreutils < 9.5): renameat2(RENAME_EXCHANGE)
+EXCHANGE_PY = (
+    "import ctypes, os, sys\n"
+    "libc = ctypes.CDLL(None, use_errno=True)\n"
+    "if libc.renameat2(-100, os.fsencode(sys.argv[1]), -100, os.fsencode(sys.argv[2]), 2):\n"
+    "    sys.exit('renameat2: ' + os.strerror(ctypes.get_errno()))\n"
+)
+# Exit code of apply_patch when the new tree is live but copying files back from the old one failed
+CARRY_OVER_FAILED = 3
+
+
+def snapshot_manifest(tar_path):
+    # {path: sha256} for every regular file in the snapshot, plus the tar members by name
+    manifest, members = {}, {}
+    with tarfile.open(tar_path, 'r:gz') as tar:
+        for member in tar:
+            name = member.name.rstrip('/')
+            members[name] = member
+            if member.isfile():
+                digest = hashlib.sha256()
+                with tar.extractfile(member) as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b''):
+                        digest.update(chunk)
+                manifest[name] = digest.hexdigest()
+    return manifest, members
+
+
+def remote_manifest(cfg):
+    # {path: sha256} for every regular file of the live tree; hashed on the server, only digests travel
+    list_cmd = (
+        f"cd {shlex.quote(cfg.DVWA_WEB_PATH)} && {{ [ -d {SOURCE_ROOT} ] || exit 0; "
+        f"find {SOURCE_ROOT} -type f -print0 | xargs -0 -r sha256sum; }}"
+    )
+    result = subprocess.run(dvwa_ssh_cmd(cfg, list_cmd), capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    manifest = {}
+    for line in result.stdout.splitlines():
+        digest, _, path = line.partition('  ')
+        if digest.startswith('\\'):
+            # sha256sum escapes names containing backslashes or newlines; treat them as changed
+            continue
+        manifest[path] = digest
+    return manifest
+
+
+def plan(local, remote, delete=False):
+    # Returns (changed paths, extra paths) comparing the snapshot with the live tree
+    changed = sorted(path for path, digest in local.items() if remote.get(path) != digest)
+    extra = sorted(path for path in remote if path not in local) if delete else []
+    return changed, extra
+
+
+def build_patch(tar_path, members, changed, extra):
+    # A tar.gz with the changed files, the snapshot's symlinks, and the list of paths to delete
+    patch = tempfile.TemporaryFile()
+    with tarfile.open(tar_path, 'r:gz') as src, tarfile.open(fileobj=patch, mode='w:gz') as out:
+        wanted = set(changed)
+        for name, member in members.items():
+            if member.isfile():
+                if name in wanted:
+                    out.addfile(member, src.extractfile(member))
+            elif member.issym():
+                # Links are not hashed remotely; they are tiny, so always resend them
+                out.addfile(member)
+            # Directories are created by tar as parents of the files that need them
+        listing = ''.join(f"{path}\0" for path in extra).encode()
+        info = tarfile.TarInfo(DELETE_LIST)
+        info.size = len(listing)
+        out.addfile(info, io.BytesIO(listing))
+    patch.seek(0)
+    return patch
+
+
+def stage_path(cfg):
+    return cfg.DVWA_STAGE_PATH or posixpath.dirname(cfg.DVWA_WEB_PATH.rstrip('/')) or '/'
+
+
+def apply_patch(cfg, patch):
+    # Stage a hardlink clone, patch it, then exchange it with the live tree in one rename.
+    # Returns 0, 1 if the live tree was left untouched, or CARRY_OVER_FAILED.
+    stage_root = shlex.quote(stage_path(cfg))
+    stage = shlex.quote(posixpath.join(stage_path(cfg), STAGE_DIR))
+    staged = shlex.quote(posixpath.join(stage_path(cfg), STAGE_DIR, SOURCE_ROOT))
+    live = shlex.quote(posixpath.join(cfg.DVWA_WEB_PATH, SOURCE_ROOT))
+    delete_cmd = f"(cd {stage} && xargs -0 -r rm -f -- < {DELETE_LIST})"
+    apply_cmd = (
+        f"set -e; "
+        f"if [ \"$(stat -c %d {stage_root})\" != \"$(stat -c %d {shlex.quote(cfg.DVWA_WEB_PATH)})\" ]; then "
+        f"echo 'DVWA_STAGE_PATH is not on the same filesystem as DVWA_WEB_PATH.' >&2; exit 1; fi; "
+        f"rm -rf {stage}; mkdir {stage}; "
+        f"if [ -d {live} ]; then cp -al {live} {staged}; fi; "
+        # --unlink-first replaces files instead of writing through hardlinks shared with the live tree
+        f"tar -xzUf - -C {stage}; {delete_cmd}; "
+        f"if [ ! -d {live} ]; then mv {staged} {live}; rm -rf {stage}; exit 0; fi; "
+        f"mv --exchange -T {staged} {live} 2>/dev/null || python3 -c {shlex.quote(EXCHANGE_PY)} {staged} {live} || "
+        f"{{ echo 'Cannot exchange the trees: needs mv --exchange (coreutils 9.5+) or python3.' >&2; exit 1; }}; "
+        # The previous tree is now the staged one. Files created in it after the clone (uploads,
+        # sessions) are hardlinked back, except paths this restore deletes. -n skips every entry the
+        # restored tree already has, so no file data is read.
+        f"{{ {delete_cmd} && cp -aln {staged}/. {live}/; }} "
+        f"|| exit {CARRY_OVER_FAILED}; "
+        f"rm -rf {stage}"
+    )
+    result = subprocess.run(dvwa_ssh_cmd(cfg, apply_cmd), stdin=patch)
+    return result.returncode
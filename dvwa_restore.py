@@ -1,217 +1,236 @@
+import argparse
 import os
 import subprocess
 import sys
-from dotenv import load_dotenv
-from pathlib import Path
-
-# Load environment variables from .env
-load_dotenv()
-
-DVWA_HOST = os.getenv('DVWA_HOST')
-DVWA_USER = os.getenv('DVWA_USER')
-DVWA_PASSWORD = os.getenv('DVWA_PASSWORD')
-DVWA_SSH_PORT = os.getenv('DVWA_SSH_PORT', '2222')
-DVWA_SSH_KEY = os.getenv('DVWA_SSH_KEY')
-DVWA_WEB_PATH = os.getenv('DVWA_WEB_PATH', '/var/www/html')
-DVWA_DB_NAME = os.getenv('DVWA_DB_NAME', 'dvwa')
-DVWA_DB_USER = os.getenv('DVWA_DB_USER', 'root')
-DVWA_DB_PASSWORD = os.getenv('DVWA_DB_PASSWORD')
-LOCAL_BACKUP_DIR = os.getenv('LOCAL_BACKUP_DIR')
-GDRIVE_SOURCE_FILE_ID = os.getenv('GDRIVE_SOURCE_FILE_ID')  # Google Drive file ID for source backup
-GDRIVE_DB_FILE_ID = os.getenv('GDRIVE_DB_FILE_ID')  # Google Drive file ID for database backup
-
-# Check required env vars
-required_vars = [
-    'DVWA_HOST', 'DVWA_USER', 'DVWA_DB_PASSWORD',
-    'LOCAL_BACKUP_DIR', 'GDRIVE_SOURCE_FILE_ID', 'GDRIVE_DB_FILE_ID'
-]
-for var in required_vars:
-    if not os.getenv(var):
-        print(f"Missing required env var: {var}")
-        sys.exit(1)
 
-# Ensure local backup directory exists
-Path(LOCAL_BACKUP_DIR).mkdir(parents=True, exist_ok=True)
-
-# Helper function to find downloaded file
-def get_downloaded_filename(folder, file_id):
-    # gdrive names the file as <file_id> if the original name is not available
-    for f in os.listdir(folder):
-        if file_id in f:
-            return os.path.join(folder, f)
-    # fallback: return the most recent file
-    files = [os.path.join(folder, f) for f in os.listdir(folder)]
-    if files:
-        return max(files, key=os.path.getctime)
-    return None
-
-# Step 1: Download source backup from Google Drive
-print(f"Downloading source backup from Google Drive (ID: {GDRIVE_SOURCE_FILE_ID})...")
-gdrive_download_cmd = [
-    'gdrive', 'files', 'download', '--destination', LOCAL_BACKUP_DIR, '--overwrite', GDRIVE_SOURCE_FILE_ID
-]
-result = subprocess.run(gdrive_download_cmd)
-if result.returncode != 0:
-    print("Failed to download source backup from Google Drive.")
-    sys.exit(1)
-
-local_source_backup = get_downloaded_filename(LOCAL_BACKUP_DIR, GDRIVE_SOURCE_FILE_ID)
-if not local_source_backup:
-    print("Could not find downloaded source backup file.")
-    sys.exit(1)
-print(f"Source backup downloaded to {local_source_backup}")
-
-# Step 2: Download database backup from Google Drive
-print(f"Downloading database backup from Google Drive (ID: {GDRIVE_DB_FILE_ID})...")
-gdrive_download_cmd = [
-    'gdrive', 'files', 'download', '--destination', LOCAL_BACKUP_DIR, '--overwrite', GDRIVE_DB_FILE_ID
-]
-result = subprocess.run(gdrive_download_cmd)
-if result.returncode != 0:
-    print("Failed to download database backup from Google Drive.")
-    sys.exit(1)
-
-local_db_backup = get_downloaded_filename(LOCAL_BACKUP_DIR, GDRIVE_DB_FILE_ID)
-if not local_db_backup:
-    print("Could not find downloaded database backup file.")
-    sys.exit(1)
-print(f"Database backup downloaded to {local_db_backup}")
-
-# Determine SSH authentication method
-ssh_auth = []
-if DVWA_SSH_KEY and os.path.exists(os.path.expanduser(DVWA_SSH_KEY)):
-    ssh_auth = ['-i', os.path.expanduser(DVWA_SSH_KEY)]
-elif DVWA_PASSWORD:
-    # Check for sshpass
-    if subprocess.call(['which', 'sshpass'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) != 0:
-        print("sshpass is required for password authentication. Please install it (e.g., brew install hudochenkov/sshpass/sshpass).")
-        sys.exit(1)
-    ssh_auth = ['sshpass', '-p', DVWA_PASSWORD]
-else:
-    print("Either DVWA_SSH_KEY or DVWA_PASSWORD must be provided.")
-    sys.exit(1)
-
-print(f"Restoring DVWA to {DVWA_HOST}...")
-
-# Step 3: Upload source backup to remote server
-remote_source_backup = f"/tmp/{os.path.basename(local_source_backup)}"
-print(f"Uploading source backup to remote server...")
-
-if ssh_auth[0] == 'sshpass':
-    scp_cmd = ssh_auth + [
-        'scp', '-o', 'StrictHostKeyChecking=no', '-P', DVWA_SSH_PORT,
-        local_source_backup,
-        f'{DVWA_USER}@{DVWA_HOST}:{remote_source_backup}'
-    ]
-else:
-    scp_cmd = [
-        'scp', '-o', 'StrictHostKeyChecking=no', '-P', DVWA_SSH_PORT
-    ] + ssh_auth + [
-        local_source_backup,
-        f'{DVWA_USER}@{DVWA_HOST}:{remote_source_backup}'
-    ]
+from common import (
+    dvwa_remote, dvwa_scp_cmd, dvwa_ssh_auth, dvwa_ssh_cmd, ensure_backup_dir,
+    get_downloaded_filename, load_config, require,
+)
+import dvwa_delta
+from dumpfile import is_gzip
+from dvwa_binlog import parse_until, read_dump_coords, segments_from
 
-result = subprocess.run(scp_cmd)
-if result.returncode != 0:
-    print("Failed to upload source backup to remote server.")
-    sys.exit(1)
 
-print("Source backup uploaded successfully.")
+def restore_source(cfg, args, local_source_backup):
+    if args.delta:
+        restore_source_delta(cfg, local_source_backup, args.delete)
+        return
 
-# Step 4: Upload database backup to remote server
-remote_db_backup = f"/tmp/{os.path.basename(local_db_backup)}"
-print(f"Uploading database backup to remote server...")
+    # Upload source backup to remote server
+    remote_source_backup = f"/tmp/{os.path.basename(local_source_backup)}"
+    print("Uploading source backup to remote server...")
 
-if ssh_auth[0] == 'sshpass':
-    scp_cmd = ssh_auth + [
-        'scp', '-o', 'StrictHostKeyChecking=no', '-P', DVWA_SSH_PORT,
-        local_db_backup,
-        f'{DVWA_USER}@{DVWA_HOST}:{remote_db_backup}'
-    ]
-else:
-    scp_cmd = [
-        'scp', '-o', 'StrictHostKeyChecking=no', '-P', DVWA_SSH_PORT
-    ] + ssh_auth + [
-        local_db_backup,
-        f'{DVWA_USER}@{DVWA_HOST}:{remote_db_backup}'
-    ]
+    result = subprocess.run(dvwa_scp_cmd(cfg, local_source_backup, dvwa_remote(cfg, remote_source_backup)))
+    if result.returncode != 0:
+        print("Failed to upload source backup to remote server.")
+        sys.exit(1)
 
-result = subprocess.run(scp_cmd)
-if result.returncode != 0:
-    print("Failed to upload database backup to remote server.")
-    sys.exit(1)
+    print("Source backup uploaded successfully.")
 
-print("Database backup uploaded successfully.")
+    # Extract source backup on remote server
+    print("Extracting source backup on remote server...")
+    extract_cmd = f"tar -xvzf {remote_source_backup} -C {cfg.DVWA_WEB_PATH}/ && rm -f {remote_source_backup}"
 
-# Step 5: Extract source backup on remote server
-print("Extracting source backup on remote server...")
-extract_cmd = f"tar -xvzf {remote_source_backup} -C {DVWA_WEB_PATH}/"
+    result = subprocess.run(dvwa_ssh_cmd(cfg, extract_cmd))
+    if result.returncode != 0:
+        print("Failed to extract source backup on remote server.")
+        sys.exit(1)
 
-if ssh_auth[0] == 'sshpass':
-    ssh_cmd = ssh_auth + [
-        'ssh', '-o', 'StrictHostKeyChecking=no', '-p', DVWA_SSH_PORT,
-        f'{DVWA_USER}@{DVWA_HOST}',
-        extract_cmd
-    ]
-else:
-    ssh_cmd = [
-        'ssh', '-o', 'StrictHostKeyChecking=no', '-p', DVWA_SSH_PORT
-    ] + ssh_auth + [
-        f'{DVWA_USER}@{DVWA_HOST}',
-        extract_cmd
-    ]
+    print("Source files restored successfully.")
 
-result = subprocess.run(ssh_cmd)
-if result.returncode != 0:
-    print("Failed to extract source backup on remote server.")
-    sys.exit(1)
 
-print("Source files restored successfully.")
+def restore_source_delta(cfg, local_source_backup, delete):
+    print("Hashing snapshot and live source tree...")
+    local, members = dvwa_delta.snapshot_manifest(local_source_backup)
+    remote = dvwa_delta.remote_manifest(cfg)
+    if remote is None:
+        print("Failed to list source files on remote server.")
+        sys.exit(1)
 
-# Step 6: Restore database on remote server
-print("Restoring database on remote server...")
-restore_db_cmd = f"mysql -u {DVWA_DB_USER} -p'{DVWA_DB_PASSWORD}' {DVWA_DB_NAME} < {remote_db_backup}"
+    changed, extra = dvwa_delta.plan(local, remote, delete)
+    print(f"{len(changed)} file(s) differ from the snapshot, {len(extra)} extra file(s) to delete "
+          f"({len(local) - len(changed)} unchanged).")
+    for path in changed:
+        print(f"  ~ {path}")
+    for path in extra:
+        print(f"  - {path}")
+    if not changed and not extra:
+        print("Source tree already matches the snapshot.")
+        return
+
+    print("Applying changes on remote server...")
+    with dvwa_delta.build_patch(local_source_backup, members, changed, extra) as patch:
+        returncode = dvwa_delta.apply_patch(cfg, patch)
+    if returncode == dvwa_delta.CARRY_OVER_FAILED:
+        print("The restored tree is live, but files created during the restore could not be copied into it. "
+              f"The previous tree is kept in {dvwa_delta.stage_path(cfg)}/{dvwa_delta.STAGE_DIR}/.")
+        sys.exit(1)
+    if returncode != 0:
+        print("Failed to apply source changes on remote server. The live tree was left untouched.")
+        sys.exit(1)
 
-if ssh_auth[0] == 'sshpass':
-    ssh_cmd = ssh_auth + [
-        'ssh', '-o', 'StrictHostKeyChecking=no', '-p', DVWA_SSH_PORT,
-        f'{DVWA_USER}@{DVWA_HOST}',
-        restore_db_cmd
-    ]
-else:
-    ssh_cmd = [
-        'ssh', '-o', 'StrictHostKeyChecking=no', '-p', DVWA_SSH_PORT
-    ] + ssh_auth + [
-        f'{DVWA_USER}@{DVWA_HOST}',
-        restore_db_cmd
+    print("Source files restored successfully.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Restore DVWA source and database from Google Drive")
+    parser.add_argument('--until', type=parse_until, metavar="'YYYY-MM-DD HH:MM:SS'",
+                        help="after the dump, replay shipped binlogs up to this time (server local time)")
+    parser.add_argument('--delta', action='store_true',
+                        help="only write source files that differ from the snapshot, then exchange the staged tree with the live one")
+    parser.add_argument('--delete', action='store_true',
+                        help="with --delta, also remove files that are not in the snapshot")
+    parser.add_argument('--source-only', action='store_true', help="restore the source tree but not the database")
+    parser.add_argument('--source-file', metavar='PATH',
+                        help="use this local dvwa_source_backup_*.tar.gz instead of downloading GDRIVE_SOURCE_FILE_ID")
+    args = parser.parse_args(argv)
+
+    if args.delete and not args.delta:
+        parser.error("--delete requires --delta")
+    if args.until and args.source_only:
+        parser.error("--until restores the database and cannot be combined with --source-only")
+
+    required_vars = ['DVWA_HOST', 'DVWA_USER', 'DVWA_DB_PASSWORD', 'LOCAL_BACKUP_DIR']
+    if not args.source_file:
+        required_vars.append('GDRIVE_SOURCE_FILE_ID')
+    if not args.source_only:
+        required_vars.append('GDRIVE_DB_FILE_ID')
+
+    cfg = load_config()
+    require(cfg, *required_vars)
+
+    # Ensure local backup directory exists
+    ensure_backup_dir(cfg)
+
+    # Step 1: Download source backup from Google Drive
+    if args.source_file:
+        if not os.path.isfile(args.source_file):
+            print(f"Source backup {args.source_file} not found.")
+            sys.exit(1)
+        local_source_backup = args.source_file
+        print(f"Using local source backup {local_source_backup}")
+    else:
+        print(f"Downloading source backup from Google Drive (ID: {cfg.GDRIVE_SOURCE_FILE_ID})...")
+        gdrive_download_cmd = [
+            'gdrive', 'files', 'download', '--destination', cfg.LOCAL_BACKUP_DIR, '--overwrite', cfg.GDRIVE_SOURCE_FILE_ID
+        ]
+        result = subprocess.run(gdrive_download_cmd)
+        if result.returncode != 0:
+            print("Failed to download source backup from Google Drive.")
+            sys.exit(1)
+
+        local_source_backup = get_downloaded_filename(cfg.LOCAL_BACKUP_DIR, cfg.GDRIVE_SOURCE_FILE_ID)
+        if not local_source_backup:
+            print("Could not find downloaded source backup file.")
+            sys.exit(1)
+        print(f"Source backup downloaded to {local_source_backup}")
+
+    if args.source_only:
+        restore_source(cfg, args, local_source_backup)
+        print("\nRestore completed successfully!")
+        print(f"DVWA source has been restored to {cfg.DVWA_HOST}")
+        return
+
+    # Step 2: Download database backup from Google Drive
+    print(f"Downloading database backup from Google Drive (ID: {cfg.GDRIVE_DB_FILE_ID})...")
+    gdrive_download_cmd = [
+        'gdrive', 'files', 'download', '--destination', cfg.LOCAL_BACKUP_DIR, '--overwrite', cfg.GDRIVE_DB_FILE_ID
     ]
+    result = subprocess.run(gdrive_download_cmd)
+    if result.returncode != 0:
+        print("Failed to download database backup from Google Drive.")
+        sys.exit(1)
 
-result = subprocess.run(ssh_cmd)
-if result.returncode != 0:
-    print("Failed to restore database on remote server.")
-    sys.exit(1)
+    local_db_backup = get_downloaded_filename(cfg.LOCAL_BACKUP_DIR, cfg.GDRIVE_DB_FILE_ID)
+    if not local_db_backup:
+        print("Could not find downloaded database backup file.")
+        sys.exit(1)
+    print(f"Database backup downloaded to {local_db_backup}")
+
+    # Point-in-time recovery starts at the binlog position recorded in the dump
+    binlog_segments = []
+    if args.until:
+        coords = read_dump_coords(local_db_backup)
+        if not coords:
+            print("The database backup has no binlog coordinates. Take backups with DVWA_DUMP_BINLOG_COORDS=1 to use --until.")
+            sys.exit(1)
+        start_file, start_pos = coords
+        binlog_segments = segments_from(cfg, start_file)
+        if not binlog_segments or os.path.basename(binlog_segments[0]) != start_file:
+            print(f"Binlog segment {start_file} has not been shipped. Run dvwa_binlog.py first.")
+            sys.exit(1)
+        print(f"Will replay {len(binlog_segments)} binlog segment(s) from {start_file}:{start_pos} until {args.until}")
+
+    # Determine SSH authentication method before touching the server
+    dvwa_ssh_auth(cfg)
+
+    print(f"Restoring DVWA to {cfg.DVWA_HOST}...")
+
+    # Step 3: Upload database backup to remote server
+    remote_db_backup = f"/tmp/{os.path.basename(local_db_backup)}"
+    print("Uploading database backup to remote server...")
+
+    result = subprocess.run(dvwa_scp_cmd(cfg, local_db_backup, dvwa_remote(cfg, remote_db_backup)))
+    if result.returncode != 0:
+        print("Failed to upload database backup to remote server.")
+        sys.exit(1)
 
-print("Database restored successfully.")
+    print("Database backup uploaded successfully.")
 
-# Step 7: Clean up temporary files on remote server (optional)
-print("Cleaning up temporary files on remote server...")
-cleanup_cmd = f"rm -f {remote_source_backup} {remote_db_backup}"
+    # Step 4: Restore source files on remote server
+    restore_source(cfg, args, local_source_backup)
 
-if ssh_auth[0] == 'sshpass':
-    ssh_cmd = ssh_auth + [
-        'ssh', '-o', 'StrictHostKeyChecking=no', '-p', DVWA_SSH_PORT,
-        f'{DVWA_USER}@{DVWA_HOST}',
-        cleanup_cmd
-    ]
-else:
-    ssh_cmd = [
-        'ssh', '-o', 'StrictHostKeyChecking=no', '-p', DVWA_SSH_PORT
-    ] + ssh_auth + [
-        f'{DVWA_USER}@{DVWA_HOST}',
-        cleanup_cmd
-    ]
+    # Step 5: Restore database on remote server
+    print("Restoring database on remote server...")
+    mysql_cmd = f"mysql -u {cfg.DVWA_DB_USER} -p'{cfg.DVWA_DB_PASSWORD}' {cfg.DVWA_DB_NAME}"
+    if is_gzip(local_db_backup):
+        # Check the whole file first, so a corrupt archive never loads half a database
+        restore_db_cmd = f"gunzip -t {remote_db_backup} && gunzip -c {remote_db_backup} | {mysql_cmd}"
+    else:
+        restore_db_cmd = f"{mysql_cmd} < {remote_db_backup}"
 
-subprocess.run(ssh_cmd)  # Don't fail if cleanup fails
+    result = subprocess.run(dvwa_ssh_cmd(cfg, restore_db_cmd))
+    if result.returncode != 0:
+        print("Failed to restore database on remote server.")
+        sys.exit(1)
 
-print("\nRestore completed successfully!")
-print(f"DVWA has been restored to {DVWA_HOST}")
+    print("Database restored successfully.")
+
+    # Step 5b: Roll the database forward with shipped binlogs
+    remote_binlog_dir = f"/tmp/dvwa_binlogs_{os.getpid()}"
+    if binlog_segments:
+        print(f"Replaying binlogs until {args.until}...")
+        result = subprocess.run(dvwa_ssh_cmd(cfg, f"mkdir -p {remote_binlog_dir}"))
+        if result.returncode == 0:
+            result = subprocess.run(dvwa_scp_cmd(cfg, *binlog_segments, dvwa_remote(cfg, f"{remote_binlog_dir}/")))
+        if result.returncode != 0:
+            print("Failed to upload binlogs to remote server.")
+            sys.exit(1)
+
+        remote_segments = ' '.join(f"{remote_binlog_dir}/{os.path.basename(p)}" for p in binlog_segments)
+        # Decoded to a file first so a mysqlbinlog failure is not masked by the pipe
+        replay_cmd = (
+            f"mysqlbinlog --start-position={start_pos} --stop-datetime='{args.until:%Y-%m-%d %H:%M:%S}' "
+            f"--database={cfg.DVWA_DB_NAME} {remote_segments} > {remote_binlog_dir}/replay.sql "
+            f"&& mysql -u {cfg.DVWA_DB_USER} -p'{cfg.DVWA_DB_PASSWORD}' {cfg.DVWA_DB_NAME} < {remote_binlog_dir}/replay.sql"
+        )
+        result = subprocess.run(dvwa_ssh_cmd(cfg, replay_cmd))
+        if result.returncode != 0:
+            print("Failed to replay binlogs on remote server.")
+            sys.exit(1)
+
+        print(f"Database rolled forward to {args.until}.")
+
+    # Step 6: Clean up temporary files on remote server (optional)
+    print("Cleaning up temporary files on remote server...")
+    cleanup_cmd = f"rm -rf {remote_db_backup} {remote_binlog_dir}"
+
+    subprocess.run(dvwa_ssh_cmd(cfg, cleanup_cmd))  # Don't fail if cleanup fails
+
+    print("\nRestore completed successfully!")
+    print(f"DVWA has been restored to {cfg.DVWA_HOST}")
+
+
+if __name__ == '__main__':
+    main()
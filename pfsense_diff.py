@@ -0,0 +1,389 @@
+import argparse
+import hashlib
+import os
+import json
+import re
+import sys
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from pathlib import Path
+
+from common import load_config, require
+
+# Bump whenever the normalized representation changes so stale cache entries are ignored
+CACHE_VERSION = 3
+CACHE_DIR_NAME = '.pfsense_diff_cache'
+
+# pfsense_backup_<timestamp>.xml, optionally pfsense_backup_<host>_<timestamp>.xml
+SNAPSHOT_RE = re.compile(r'^pfsense_backup_(?:(?P<host>.+)_)?(?P<ts>\d{8}_\d{6})\.xml$')
+
+# Sections with a semantic diff: name -> (parent path, child tag or None for "any", key field)
+SECTIONS = {
+    'rules': ('filter', 'rule', 'tracker'),
+    'aliases': ('aliases', 'alias', 'name'),
+    'interfaces': ('interfaces', None, None),
+    'users': ('system', 'user', 'name'),
+}
+
+# Elements that change on every save and carry no configuration meaning
+VOLATILE_TAGS = {'revision', 'lastchange'}
+
+
+class Snapshot:
+    __slots__ = ('path', 'host', 'timestamp', 'digest', 'sections', 'rule_order', 'other')
+
+    def __init__(self, path, host, timestamp, digest, sections, rule_order, other):
+        self.path = path
+        self.host = host
+        self.timestamp = timestamp
+        self.digest = digest
+        # section name -> {item key: {field path: value}}
+        self.sections = sections
+        # interface (or 'floating') -> rule keys in evaluation order; pfSense applies the first match
+        self.rule_order = rule_order
+        # top-level tag -> digest, for everything not covered by SECTIONS
+        self.other = other
+
+    @property
+    def name(self):
+        return os.path.basename(self.path)
+
+
+def parse_snapshot_name(path):
+    # Returns (host, timestamp); host is '' for the default firewall
+    match = SNAPSHOT_RE.match(os.path.basename(path))
+    if match:
+        return match.group('host') or '', datetime.strptime(match.group('ts'), '%Y%m%d_%H%M%S')
+    return '', datetime.fromtimestamp(os.path.getmtime(path))
+
+
+def _flatten(elem, prefix='', out=None):
+    # Flatten an element into {relative path: text}; repeated tags get an index suffix
+    if out is None:
+        out = {}
+    counts = {}
+    for child in elem:
+        if child.tag in VOLATILE_TAGS:
+            continue
+        counts[child.tag] = counts.get(child.tag, 0) + 1
+    seen = {}
+    for child in elem:
+        if child.tag in VOLATILE_TAGS:
+            continue
+        tag = child.tag
+        if counts[tag] > 1:
+            seen[tag] = seen.get(tag, 0) + 1
+            tag = f"{tag}[{seen[tag]}]"
+        path = f"{prefix}/{tag}" if prefix else tag
+        if len(child):
+            _flatten(child, path, out)
+        else:
+            out[path] = (child.text or '').strip()
+        for attr, value in sorted(child.attrib.items()):
+            out[f"{path}@{attr}"] = value
+    return out
+
+
+def _canonical(elem):
+    # Stable byte form of a subtree: volatile tags dropped, whitespace stripped
+    parts = []
+
+    def walk(node):
+        if node.tag in VOLATILE_TAGS:
+            return
+        attrs = ''.join(f' {k}="{v}"' for k, v in sorted(node.attrib.items()))
+        parts.append(f"<{node.tag}{attrs}>{(node.text or '').strip()}")
+        for child in node:
+            walk(child)
+        parts.append(f"</{node.tag}>")
+
+    walk(elem)
+    return ''.join(parts).encode()
+
+
+def _item_key(fields, key_field, index, tag):
+    if key_field and fields.get(key_field):
+        return fields[key_field]
+    # Rules without a tracker fall back to their description, then position
+    if fields.get('descr'):
+        return f"{tag}:{fields['descr']}"
+    return f"{tag}#{index}"
+
+
+def _rule_group(fields):
+    if fields.get('floating'):
+        return 'floating'
+    return fields.get('interface', '')
+
+
+def _extract_sections(root):
+    sections = {}
+    rule_order = {}
+    covered = set()
+    for name, (parent_tag, child_tag, key_field) in SECTIONS.items():
+        items = {}
+        parent = root.find(parent_tag)
+        if parent is not None:
+            if child_tag is None:
+                covered.add(parent_tag)
+                for child in parent:
+                    items[child.tag] = _flatten(child)
+            else:
+                if parent_tag != 'system':
+                    covered.add(parent_tag)
+                for index, child in enumerate(parent.findall(child_tag), 1):
+                    fields = _flatten(child)
+                    key = _item_key(fields, key_field, index, child_tag)
+                    while key in items:
+                        key += "'"
+                    items[key] = fields
+                    if name == 'rules':
+                        rule_order.setdefault(_rule_group(fields), []).append(key)
+        sections[name] = items
+
+    other = {}
+    for child in root:
+        if child.tag in covered or child.tag in VOLATILE_TAGS:
+            continue
+        if child.tag == 'system':
+            # Users are diffed on their own; the rest of <system> is tracked as a blob
+            stripped = ET.Element('system')
+            stripped.extend(c for c in child if c.tag != 'user')
+            other['system'] = hashlib.sha256(_canonical(stripped)).hexdigest()
+        else:
+            other[child.tag] = hashlib.sha256(_canonical(child)).hexdigest()
+    return sections, rule_order, other
+
+
+def _parse(path):
+    root = ET.parse(path).getroot()
+    sections, rule_order, other = _extract_sections(root)
+    digest = hashlib.sha256(_canonical(root)).hexdigest()
+    host, timestamp = parse_snapshot_name(path)
+    return Snapshot(path, host, timestamp, digest, sections, rule_order, other)
+
+
+# In-process cache: (realpath, size, mtime_ns) -> Snapshot
+_memory_cache = {}
+
+
+def _cache_key(path):
+    path = os.path.realpath(path)
+    st = os.stat(path)
+    return (path, st.st_size, st.st_mtime_ns)
+
+
+def cache_file_for(key, cache_dir=None):
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(key[0]), CACHE_DIR_NAME)
+    cache_name = hashlib.sha1(repr((CACHE_VERSION,) + key).encode()).hexdigest() + '.json'
+    return os.path.join(cache_dir, cache_name)
+
+
+def _load_cached(path, cache_file):
+    # JSON rather than pickle: the cache sits in a shared backup directory, and loading it must never
+    # run code. Anything unreadable is a cache miss.
+    try:
+        with open(cache_file) as f:
+            state = json.load(f)
+        return Snapshot(path, state['host'], datetime.fromisoformat(state['timestamp']), state['digest'],
+                        state['sections'], state['rule_order'], state['other'])
+    except Exception:
+        return None
+
+
+def load_snapshot(path, cache_dir=None):
+    key = _cache_key(path)
+    path = key[0]
+    snapshot = _memory_cache.get(key)
+    if snapshot is not None:
+        return snapshot
+
+    cache_file = cache_file_for(key, cache_dir)
+    snapshot = _load_cached(path, cache_file)
+    if snapshot is None:
+        snapshot = _parse(path)
+        try:
+            Path(os.path.dirname(cache_file)).mkdir(parents=True, exist_ok=True)
+            tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+            with open(tmp_file, 'w') as f:
+                json.dump({
+                    'host': snapshot.host,
+                    'timestamp': snapshot.timestamp.isoformat(),
+                    'digest': snapshot.digest,
+                    'sections': snapshot.sections,
+                    'rule_order': snapshot.rule_order,
+                    'other': snapshot.other,
+                }, f, separators=(',', ':'))
+            os.replace(tmp_file, cache_file)
+        except OSError:
+            pass  # Cache is best effort; a read-only backup dir still works
+
+    _memory_cache[key] = snapshot
+    return snapshot
+
+
+def prune_cache(keep):
+    # Removes cache entries of snapshots that were deleted or rewritten (and older cache formats)
+    # from the cache directories holding the files in keep
+    for cache_dir in {os.path.dirname(f) for f in keep}:
+        try:
+            names = os.listdir(cache_dir)
+        except OSError:
+            continue
+        for name in names:
+            cache_file = os.path.join(cache_dir, name)
+            if name.endswith(('.json', '.pickle')) and cache_file not in keep:
+                try:
+                    os.remove(cache_file)
+                except OSError:
+                    pass
+
+
+def _rule_moves(old, new):
+    # {group: {rule key: (old position, new position)}} for rules kept in a group whose relative
+    # order changed; added and removed rules alone do not count as moves
+    moves = {}
+    for group in old.rule_order.keys() & new.rule_order.keys():
+        new_keys = set(new.rule_order[group])
+        old_keys = set(old.rule_order[group])
+        before = [k for k in old.rule_order[group] if k in new_keys]
+        after = [k for k in new.rule_order[group] if k in old_keys]
+        if before == after:
+            continue
+        moves[group] = {
+            key: (before.index(key) + 1, after.index(key) + 1)
+            for key in after if before.index(key) != after.index(key)
+        }
+    return moves
+
+
+def diff_snapshots(old, new):
+    # Returns {section: {'added': {...}, 'removed': {...}, 'changed': {key: {field: (old, new)}}}};
+    # rules also get 'moved': {group: {key: (old position, new position)}}
+    result = {}
+    if old.digest == new.digest:
+        return result
+
+    for name in SECTIONS:
+        old_items = old.sections.get(name, {})
+        new_items = new.sections.get(name, {})
+        moved = _rule_moves(old, new) if name == 'rules' else {}
+        if old_items == new_items and not moved:
+            continue
+        added = {k: v for k, v in new_items.items() if k not in old_items}
+        removed = {k: v for k, v in old_items.items() if k not in new_items}
+        changed = {}
+        for key in old_items.keys() & new_items.keys():
+            before, after = old_items[key], new_items[key]
+            if before == after:
+                continue
+            changed[key] = {
+                field: (before.get(field), after.get(field))
+                for field in sorted(before.keys() | after.keys())
+                if before.get(field) != after.get(field)
+            }
+        result[name] = {'added': added, 'removed': removed, 'changed': changed}
+        if moved:
+            result[name]['moved'] = moved
+
+    other_changed = sorted(
+        tag for tag in old.other.keys() | new.other.keys()
+        if old.other.get(tag) != new.other.get(tag)
+    )
+    if other_changed:
+        result['other'] = other_changed
+    if not result:
+        # The canonical forms differ, e.g. aliases or users were only reordered
+        result['unexplained'] = True
+    return result
+
+
+def find_snapshots(folder):
+    return [
+        os.path.join(folder, f) for f in os.listdir(folder)
+        if f.startswith('pfsense_backup_') and f.endswith('.xml')
+    ]
+
+
+def diff_chain(paths, cache_dir=None):
+    # Yields (old, new, diff) for consecutive snapshots of each firewall, oldest first
+    snapshots = [load_snapshot(p, cache_dir) for p in paths]
+    snapshots.sort(key=lambda s: (s.host, s.timestamp, s.name))
+    previous = None
+    for snapshot in snapshots:
+        if previous is not None and previous.host == snapshot.host:
+            yield previous, snapshot, diff_snapshots(previous, snapshot)
+        previous = snapshot
+
+
+def _describe(fields):
+    return fields.get('descr') or fields.get('name') or fields.get('if') or ''
+
+
+def format_diff(old, new, diff):
+    lines = [f"{old.name} -> {new.name}"]
+    if not diff:
+        lines.append("  (no changes)")
+        return '\n'.join(lines)
+    for name in SECTIONS:
+        if name not in diff:
+            continue
+        section = diff[name]
+        lines.append(f"  {name}:")
+        for key, fields in sorted(section['added'].items()):
+            lines.append(f"    + {key} {_describe(fields)}".rstrip())
+        for key, fields in sorted(section['removed'].items()):
+            lines.append(f"    - {key} {_describe(fields)}".rstrip())
+        for key, fields in sorted(section['changed'].items()):
+            lines.append(f"    ~ {key}")
+            for field, (before, after) in fields.items():
+                lines.append(f"        {field}: {before!r} -> {after!r}")
+        for group, moves in sorted(section.get('moved', {}).items()):
+            lines.append(f"    ^ order on {group or '(no interface)'}:")
+            for key, (before, after) in moves.items():
+                fields = (new.sections.get(name) or {}).get(key, {})
+                lines.append(f"        {key} {_describe(fields)}".rstrip() + f": #{before} -> #{after}")
+    if 'other' in diff:
+        lines.append(f"  other sections changed: {', '.join(diff['other'])}")
+    if diff.get('unexplained'):
+        lines.append("  changed outside the compared fields (for example element order)")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Semantic diff of pfSense config.xml snapshots")
+    parser.add_argument('files', nargs='*', help="Two snapshots to compare, or a directory with --chain")
+    parser.add_argument('--chain', action='store_true', help="Diff every consecutive pair of snapshots in order")
+    parser.add_argument('--changes-only', action='store_true', help="With --chain, skip pairs without changes")
+    args = parser.parse_args(argv)
+
+    if args.chain:
+        if args.files:
+            folder = args.files[0]
+        else:
+            cfg = load_config()
+            require(cfg, 'LOCAL_BACKUP_DIR')
+            folder = cfg.LOCAL_BACKUP_DIR
+        if not os.path.isdir(folder):
+            print("Snapshot directory not found. Pass it explicitly or set LOCAL_BACKUP_DIR.")
+            sys.exit(1)
+        paths = find_snapshots(folder)
+        for old, new, diff in diff_chain(paths):
+            if diff or not args.changes_only:
+                print(format_diff(old, new, diff))
+        # Every current snapshot is cached by now; drop entries of deleted or rewritten ones
+        prune_cache({cache_file_for(_cache_key(p)) for p in paths})
+        return
+
+    if len(args.files) != 2:
+        print("Usage: python3 pfsense_diff.py <old.xml> <new.xml>")
+        print("       python3 pfsense_diff.py --chain [backup_dir]")
+        sys.exit(1)
+
+    old, new = (load_snapshot(p) for p in args.files)
+    print(format_diff(old, new, diff_snapshots(old, new)))
+
+
+if __name__ == '__main__':
+    main()
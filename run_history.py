@@ -0,0 +1,402 @@
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from common import ensure_backup_dir, format_size, load_config, require
+
+HISTORY_FILE = 'run_history.db'
+# Slowdowns smaller than this many seconds are never reported, however large in relative terms
+MIN_SLOWDOWN = 5
+
+# runs/metrics hold one row per run and measurement and are pruned after HISTORY_KEEP_DAYS.
+# daily holds per-day rollups (count, sum, sum of squares, min, max) that are kept forever,
+# so reports and baselines read a few rows per day instead of every run.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    target TEXT NOT NULL,
+    host TEXT NOT NULL,
+    ok INTEGER NOT NULL,
+    seconds REAL NOT NULL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_target_host_ts ON runs (target, host, ts);
+CREATE INDEX IF NOT EXISTS runs_ts ON runs (ts);
+CREATE TABLE IF NOT EXISTS metrics (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (run_id, name)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS daily (
+    target TEXT NOT NULL,
+    host TEXT NOT NULL,
+    name TEXT NOT NULL,
+    day TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    total REAL NOT NULL,
+    sumsq REAL NOT NULL,
+    min REAL NOT NULL,
+    max REAL NOT NULL,
+    PRIMARY KEY (target, host, name, day)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS alerts (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    ts REAL NOT NULL,
+    target TEXT NOT NULL,
+    host TEXT NOT NULL,
+    name TEXT NOT NULL,
+    message TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS alerts_ts ON alerts (ts);
+"""
+
+# Report periods: name -> SQL expression grouping a 'YYYY-MM-DD' day
+PERIODS = {
+    'day': 'day',
+    'week': "strftime('%Y-W%W', day)",
+    'month': 'substr(day, 1, 7)',
+}
+
+
+def history_path(cfg):
+    return cfg.HISTORY_DB or os.path.join(cfg.LOCAL_BACKUP_DIR, HISTORY_FILE)
+
+
+def _day(ts):
+    return datetime.fromtimestamp(ts).strftime('%Y-%m-%d')
+
+
+def format_value(name, value):
+    if name.startswith('bytes.'):
+        return format_size(value)
+    if name.startswith('ratio.'):
+        return f"{value:.1%}"
+    if name.startswith('seconds.'):
+        return f"{value:.1f}s"
+    return f"{value:g}"
+
+
+class HistoryStore:
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA foreign_keys=ON')
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def _roll_up(self, target, host, name, day, value):
+        # INSERT OR IGNORE + UPDATE instead of an upsert, which needs SQLite 3.24+
+        self.conn.execute(
+            "INSERT OR IGNORE INTO daily VALUES (?, ?, ?, ?, 0, 0, 0, ?, ?)",
+            (target, host, name, day, value, value),
+        )
+        self.conn.execute(
+            "UPDATE daily SET n = n + 1, total = total + ?, sumsq = sumsq + ?, min = MIN(min, ?), max = MAX(max, ?) "
+            "WHERE target = ? AND host = ? AND name = ? AND day = ?",
+            (value, value * value, value, value, target, host, name, day),
+        )
+
+    def baseline(self, target, host, name, since_day, before_day):
+        # (runs, mean, standard deviation) of a metric over [since_day, before_day)
+        n, total, sumsq = self.conn.execute(
+            "SELECT COALESCE(SUM(n), 0), COALESCE(SUM(total), 0), COALESCE(SUM(sumsq), 0) FROM daily "
+            "WHERE target = ? AND host = ? AND name = ? AND day >= ? AND day < ?",
+            (target, host, name, since_day, before_day),
+        ).fetchone()
+        if not n:
+            return 0, 0.0, 0.0
+        mean = total / n
+        return n, mean, max(sumsq / n - mean * mean, 0.0) ** 0.5
+
+    def record(self, ts, target, host, ok, seconds, error, metrics, detect=None):
+        # Stores one run and its rollups in one transaction; returns the alert messages raised for it
+        day = _day(ts)
+        with self.conn:
+            run_id = self.conn.execute(
+                "INSERT INTO runs (ts, target, host, ok, seconds, error) VALUES (?, ?, ?, ?, ?, ?)",
+                (ts, target, host, int(ok), seconds, error),
+            ).lastrowid
+            # Baselines are read before this run's values are rolled up
+            alerts = detect(self, target, host, day, metrics) if detect and ok else []
+            self.conn.executemany(
+                "INSERT INTO metrics (run_id, name, value) VALUES (?, ?, ?)",
+                [(run_id, name, value) for name, value in metrics.items()],
+            )
+            # Trends and baselines describe successful runs; failures are only counted
+            if ok:
+                for name, value in metrics.items():
+                    self._roll_up(target, host, name, day, value)
+            self._roll_up(target, host, 'failed', day, 0 if ok else 1)
+            self.conn.executemany(
+                "INSERT INTO alerts (run_id, ts, target, host, name, message) VALUES (?, ?, ?, ?, ?, ?)",
+                [(run_id, ts, target, host, name, message) for name, message in alerts],
+            )
+        return [message for _, message in alerts]
+
+    def prune(self, before_ts):
+        # Drops per-run rows; the daily rollups stay
+        with self.conn:
+            return self.conn.execute("DELETE FROM runs WHERE ts < ?", (before_ts,)).rowcount
+
+    def rebuild_rollups(self):
+        # Recomputes the rollups of every day that still has per-run rows
+        with self.conn:
+            first = self.conn.execute("SELECT MIN(ts) FROM runs").fetchone()[0]
+            if first is None:
+                return 0
+            first_day = _day(first)
+            self.conn.execute("DELETE FROM daily WHERE day >= ?", (first_day,))
+            self.conn.create_function('local_day', 1, _day)
+            self.conn.execute(
+                "INSERT INTO daily "
+                "SELECT target, host, name, local_day(ts), COUNT(*), SUM(value), SUM(value * value), MIN(value), MAX(value) "
+                "FROM (SELECT r.target, r.host, m.name, r.ts, m.value FROM metrics m JOIN runs r ON r.id = m.run_id "
+                "      WHERE r.ok = 1 UNION ALL SELECT target, host, 'failed', ts, 1 - ok FROM runs) "
+                "GROUP BY target, host, name, local_day(ts)"
+            )
+            return self.conn.execute("SELECT COUNT(*) FROM daily WHERE day >= ?", (first_day,)).fetchone()[0]
+
+
+# Durations that are not latency: deliberate throttling pauses are expected to vary
+NOT_LATENCY = {'seconds.paused'}
+
+
+def anomaly_detector(cfg):
+    # Compares a run's sizes and step durations with the HISTORY_BASELINE_DAYS before today
+    def detect(store, target, host, day, metrics):
+        since_day = _day(time.time() - cfg.HISTORY_BASELINE_DAYS * 86400)
+        alerts = []
+        for name, value in metrics.items():
+            n, mean, std = store.baseline(target, host, name, since_day, day)
+            if n < cfg.HISTORY_MIN_RUNS or mean <= 0:
+                continue
+            shown, typical = format_value(name, value), format_value(name, mean)
+            if name.startswith('bytes.'):
+                if value < mean * (1 - cfg.HISTORY_SHRINK_ALERT):
+                    alerts.append((name, f"{name} shrank to {shown}, {1 - value / mean:.0%} below the "
+                                         f"{cfg.HISTORY_BASELINE_DAYS}-day mean of {typical}"))
+                elif value > mean * cfg.HISTORY_GROWTH_ALERT:
+                    alerts.append((name, f"{name} grew to {shown}, {value / mean:.1f}x the "
+                                         f"{cfg.HISTORY_BASELINE_DAYS}-day mean of {typical}"))
+            elif name.startswith('seconds.') and name not in NOT_LATENCY:
+                if (value > mean * cfg.HISTORY_LATENCY_ALERT and value > mean + 3 * std
+                        and value - mean >= MIN_SLOWDOWN):
+                    alerts.append((name, f"{name} took {shown}, {value / mean:.1f}x the "
+                                         f"{cfg.HISTORY_BASELINE_DAYS}-day mean of {typical}"))
+        return alerts
+    return detect
+
+
+class RunRecorder:
+    # Collects one backup run's step durations and artifact sizes and stores them when the run ends.
+    # Recording problems are reported but never fail the backup itself.
+
+    def __init__(self, cfg, target, host):
+        self.cfg = cfg
+        self.target = target
+        self.host = host
+        self.metrics = {}
+        self.error = None
+        self._paused = 0.0
+        self._started = time.time()
+        self._clock = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    @contextmanager
+    def step(self, name):
+        # Only completed steps are timed, so a failure does not look like a fast or slow step
+        start = time.monotonic()
+        try:
+            yield
+        except BaseException:
+            if self.error is None:
+                self.error = f"failed during {name}"
+            raise
+        self.metrics[f'seconds.{name}'] = time.monotonic() - start
+
+    def metric(self, name, value):
+        self.metrics[name] = value
+
+    def paused(self, step, seconds):
+        # Time a completed step spent deliberately paused (see throttle.LoadGovernor); it is
+        # recorded as seconds.paused and left out of the step's and the run's duration
+        self.metrics['seconds.paused'] = self.metrics.get('seconds.paused', 0) + seconds
+        self.metrics[f'seconds.{step}'] -= seconds
+        self._paused += seconds
+
+    def artifact(self, kind, path, raw_bytes=None):
+        size = os.path.getsize(path)
+        self.metrics[f'bytes.{kind}'] = size
+        if raw_bytes:
+            self.metrics[f'ratio.{kind}'] = size / raw_bytes
+
+    def fail(self, message):
+        print(message)
+        self.error = message
+        sys.exit(1)
+
+    def __exit__(self, exc_type, exc, tb):
+        ok = exc_type is None or (exc_type is SystemExit and exc.code in (None, 0))
+        error = None
+        if not ok:
+            error = self.error or ('interrupted' if exc_type is KeyboardInterrupt else repr(exc))
+        elapsed = time.monotonic() - self._clock
+        if ok:
+            self.metrics['seconds.total'] = elapsed - self._paused
+        try:
+            store = HistoryStore(history_path(self.cfg))
+            try:
+                alerts = store.record(self._started, self.target, self.host, ok, elapsed, error,
+                                      self.metrics, anomaly_detector(self.cfg))
+                if self.cfg.HISTORY_KEEP_DAYS:
+                    store.prune(time.time() - self.cfg.HISTORY_KEEP_DAYS * 86400)
+            finally:
+                store.close()
+        except sqlite3.Error as e:
+            print(f"Could not record run history: {e}")
+            return False
+        for message in alerts:
+            print(f"⚠️  Anomaly: {message}")
+        return False
+
+
+def _period_rows(store, args):
+    period = PERIODS[args.period]
+    since_day = _day(time.time() - args.days * 86400)
+    where, params = ["day >= ?"], [since_day]
+    for column in ('target', 'host'):
+        if getattr(args, column):
+            where.append(f"{column} = ?")
+            params.append(getattr(args, column))
+    if args.metric:
+        where.append("name LIKE ?")
+        params.append(args.metric + '%')
+    return store.conn.execute(
+        f"SELECT target, host, name, {period} AS period, SUM(n), SUM(total), MIN(min), MAX(max) FROM daily "
+        f"WHERE {' AND '.join(where)} GROUP BY target, host, name, period ORDER BY target, host, name, period",
+        params,
+    ).fetchall()
+
+
+def cmd_report(store, args):
+    rows = _period_rows(store, args)
+    if not rows:
+        print(f"No runs recorded in the last {args.days} days.")
+        return 0
+
+    current = None
+    previous_mean = None
+    for target, host, name, period, n, total, low, high in rows:
+        if (target, host, name) != current:
+            current = (target, host, name)
+            previous_mean = None
+            print(f"\n{target} @ {host}: {name}")
+            if name == 'failed':
+                print(f"  {'period':<10} {'runs':>5} {'failed':>10}")
+            else:
+                print(f"  {'period':<10} {'runs':>5} {'mean':>10} {'min':>10} {'max':>10} {'change':>8}")
+        if name == 'failed':
+            # Shown as failure counts rather than a mean of 0/1 values
+            print(f"  {period:<10} {n:>5} {int(total):>10}")
+            continue
+        mean = total / n
+        change = f"{mean / previous_mean - 1:+.0%}" if previous_mean else ''
+        print(f"  {period:<10} {n:>5} {format_value(name, mean):>10} {format_value(name, low):>10} "
+              f"{format_value(name, high):>10} {change:>8}")
+        previous_mean = mean
+    return 0
+
+
+def cmd_runs(store, args):
+    where, params = [], []
+    for column in ('target', 'host'):
+        if getattr(args, column):
+            where.append(f"{column} = ?")
+            params.append(getattr(args, column))
+    rows = store.conn.execute(
+        "SELECT id, ts, target, host, ok, seconds, error FROM runs "
+        f"{'WHERE ' + ' AND '.join(where) if where else ''} ORDER BY ts DESC LIMIT ?",
+        params + [args.limit],
+    ).fetchall()
+    for run_id, ts, target, host, ok, seconds, error in rows:
+        sizes = store.conn.execute(
+            "SELECT name, value FROM metrics WHERE run_id = ? AND name LIKE 'bytes.%' ORDER BY name", (run_id,)
+        ).fetchall()
+        details = ', '.join(f"{name[len('bytes.'):]} {format_size(value)}" for name, value in sizes)
+        outcome = 'OK' if ok else f"FAILED ({error})"
+        print(f"{datetime.fromtimestamp(ts):%Y-%m-%d %H:%M}  {target:<8} {host:<16} {seconds:7.1f}s  {outcome}"
+              f"{'  ' + details if details else ''}")
+    return 0
+
+
+def cmd_alerts(store, args):
+    # Exits non-zero when there are alerts, so monitoring can run `run_history.py alerts --days 1`
+    rows = store.conn.execute(
+        "SELECT ts, target, host, message FROM alerts WHERE ts >= ? ORDER BY ts",
+        (time.time() - args.days * 86400,),
+    ).fetchall()
+    for ts, target, host, message in rows:
+        print(f"{datetime.fromtimestamp(ts):%Y-%m-%d %H:%M}  {target} @ {host}: {message}")
+    if not rows:
+        print(f"No anomalies in the last {args.days} day(s).")
+        return 0
+    return 1
+
+
+def cmd_rebuild(store, args):
+    print(f"Rebuilt {store.rebuild_rollups()} daily rollup row(s).")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query the backup run history")
+    sub = parser.add_subparsers(dest='command', metavar='<command>')
+    sub.required = True
+
+    p = sub.add_parser('report', help="per-period trends of sizes, durations and failures")
+    p.add_argument('--period', choices=list(PERIODS), default='week')
+    p.add_argument('--days', type=int, default=180, help="look back this many days (default: 180)")
+    p.add_argument('--metric', help="only metrics starting with this, e.g. bytes. or seconds.capture")
+    p.add_argument('--target', help="dvwa or pfsense")
+    p.add_argument('--host')
+    p.set_defaults(func=cmd_report)
+
+    p = sub.add_parser('runs', help="most recent runs")
+    p.add_argument('--limit', type=int, default=20)
+    p.add_argument('--target', help="dvwa or pfsense")
+    p.add_argument('--host')
+    p.set_defaults(func=cmd_runs)
+
+    p = sub.add_parser('alerts', help="anomalies flagged for recent runs")
+    p.add_argument('--days', type=int, default=7)
+    p.set_defaults(func=cmd_alerts)
+
+    p = sub.add_parser('rebuild', help="recompute rollups from the stored runs")
+    p.set_defaults(func=cmd_rebuild)
+    args = parser.parse_args(argv)
+
+    cfg = load_config()
+    require(cfg, 'LOCAL_BACKUP_DIR')
+    ensure_backup_dir(cfg)
+
+    store = HistoryStore(history_path(cfg))
+    try:
+        code = args.func(store, args)
+    finally:
+        store.close()
+    sys.exit(code)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+import shlex
+import subprocess
+import threading
+import time
+
+from common import dvwa_ssh_cmd
+
+CHUNK_SIZE = 64 * 1024
+# While the target stays busy, polls back off up to this multiple of BACKUP_LOAD_CHECK_INTERVAL
+MAX_BACKOFF = 8
+
+
+class RateLimiter:
+    # Token bucket with one second of burst; one instance per transfer
+
+    def __init__(self, bytes_per_sec):
+        self.rate = bytes_per_sec
+        self.tokens = bytes_per_sec
+        self.last = time.monotonic()
+
+    @classmethod
+    def from_config(cls, cfg):
+        if not cfg.BACKUP_BWLIMIT_KBPS:
+            return None
+        return cls(cfg.BACKUP_BWLIMIT_KBPS * 1024)
+
+    def consume(self, n):
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        self.tokens -= n
+        if self.tokens < 0:
+            time.sleep(-self.tokens / self.rate)
+
+
+class LoadGovernor:
+    # Polls the DVWA host and pauses transfers while load average or Threads_running is too high.
+    # Pausing the reader back-pressures the SSH pipe, so the remote tar/mysqldump stalls as well.
+
+    def __init__(self, cfg):
+        self.cfg = cfg
+        self.max_load = cfg.BACKUP_MAX_LOAD
+        self.max_threads = cfg.BACKUP_MAX_THREADS_RUNNING
+        self.interval = cfg.BACKUP_LOAD_CHECK_INTERVAL
+        self.max_pause = cfg.BACKUP_MAX_PAUSE
+        self.enabled = bool(self.max_load or self.max_threads)
+        self._clear = threading.Event()
+        self._clear.set()
+        self._stop = threading.Event()
+        self._thread = None
+        self.paused_for = 0.0
+
+    def __enter__(self):
+        if self.enabled:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._clear.set()
+        if self._thread:
+            self._thread.join()
+
+    def wait(self):
+        self._clear.wait()
+
+    def probe(self):
+        # Returns (1-minute load average, Threads_running); None when a value could not be read
+        probe_cmd = "cat /proc/loadavg"
+        if self.max_threads:
+            probe_cmd += (
+                f"; mysql -u {self.cfg.DVWA_DB_USER} -p'{self.cfg.DVWA_DB_PASSWORD}' -sN "
+                f"-e \"SHOW GLOBAL STATUS LIKE 'Threads_running'\""
+            )
+        result = subprocess.run(dvwa_ssh_cmd(self.cfg, probe_cmd), capture_output=True, text=True)
+        lines = result.stdout.splitlines()
+        load = threads = None
+        try:
+            load = float(lines[0].split()[0])
+            threads = int(lines[1].split()[1]) if self.max_threads else None
+        except (IndexError, ValueError):
+            pass
+        return load, threads
+
+    def _overloaded(self, load, threads):
+        reasons = []
+        if self.max_load and load is not None and load > self.max_load:
+            reasons.append(f"load {load:.2f} > {self.max_load}")
+        if self.max_threads and threads is not None and threads > self.max_threads:
+            reasons.append(f"Threads_running {threads} > {self.max_threads}")
+        return reasons
+
+    def _run(self):
+        backoff = 1
+        paused_at = None
+        while not self._stop.is_set():
+            reasons = self._overloaded(*self.probe())
+            now = time.monotonic()
+            if reasons and paused_at is None:
+                paused_at = now
+                print(f"Target busy ({', '.join(reasons)}), pausing transfers...")
+                self._clear.clear()
+            elif reasons and self.max_pause and now - paused_at >= self.max_pause:
+                # Never starve the backup: pausing again would keep a consistent dump's snapshot open
+                # for hours, so the rest of this run goes unpaused
+                print(f"Still busy after {self.max_pause}s, resuming and no longer pausing for this run.")
+                self.paused_for += now - paused_at
+                self._clear.set()
+                return
+            elif not reasons and paused_at is not None:
+                print(f"Target load back to normal after {now - paused_at:.0f}s, resuming transfers.")
+                self.paused_for += now - paused_at
+                paused_at = None
+                self._clear.set()
+
+            backoff = min(backoff * 2, MAX_BACKOFF) if paused_at is not None else 1
+            delay = self.interval * backoff
+            if paused_at is not None and self.max_pause:
+                # Wake up in time to honour the max pause
+                delay = max(min(delay, paused_at + self.max_pause - now), 0)
+            self._stop.wait(delay)
+
+
+def copy_stream(src, dst, limiter=None, governor=None):
+    # Copies src to dst in chunks, honouring the bandwidth cap and load pauses; returns bytes copied
+    copied = 0
+    while True:
+        if governor is not None:
+            governor.wait()
+        chunk = src.read(CHUNK_SIZE)
+        if not chunk:
+            return copied
+        if limiter is not None:
+            limiter.consume(len(chunk))
+        dst.write(chunk)
+        copied += len(chunk)
+
+
+def low_priority(cfg, remote_cmd):
+    # Runs a capture command under nice and, where available, the lowest best-effort I/O priority
+    if not cfg.BACKUP_NICE:
+        return remote_cmd
+    return (
+        f"IONICE=; command -v ionice >/dev/null 2>&1 && IONICE='ionice -c2 -n7'; "
+        f"nice -n {cfg.BACKUP_NICE} $IONICE sh -c {shlex.quote(remote_cmd)}"
+    )
@@ -0,0 +1,341 @@
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from common import ensure_backup_dir, load_config, require
+
+SPOOL_SUBDIR = '.spool'
+# A job is one JSON file whose directory is its state. Jobs move between states with
+# os.rename, which is atomic, so two workers can never claim the same job.
+PENDING, INFLIGHT, FAILED = 'pending', 'inflight', 'failed'
+JOB_SUFFIX = '.json'
+
+
+def spool_dir(cfg, state):
+    return os.path.join(cfg.LOCAL_BACKUP_DIR, SPOOL_SUBDIR, state)
+
+
+def _fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _write_job(path, job):
+    # Synced before and after the rename, so a crash leaves either the old job or the new one
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(job, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    _fsync_dir(os.path.dirname(path))
+
+
+def _read_job(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _job_files(cfg, state):
+    try:
+        return sorted(name for name in os.listdir(spool_dir(cfg, state)) if name.endswith(JOB_SUFFIX))
+    except FileNotFoundError:
+        return []
+
+
+def enqueue(cfg, path):
+    # One job per artifact name: re-enqueueing a rewritten artifact replaces its pending or failed job
+    for state in (PENDING, INFLIGHT, FAILED):
+        os.makedirs(spool_dir(cfg, state), exist_ok=True)
+    name = os.path.basename(path) + JOB_SUFFIX
+    job = {
+        'path': os.path.abspath(path),
+        'parent': cfg.GDRIVE_FOLDER_ID,
+        'enqueued': time.time(),
+        'attempts': 0,
+        'next_attempt': 0,
+        'last_error': None,
+    }
+    _write_job(os.path.join(spool_dir(cfg, PENDING), name), job)
+    _remove(os.path.join(spool_dir(cfg, FAILED), name))
+    return name
+
+
+def recover(cfg):
+    # Jobs whose worker stopped renewing the lease (crash, kill, reboot) go back to pending
+    now = time.time()
+    for name in _job_files(cfg, INFLIGHT):
+        path = os.path.join(spool_dir(cfg, INFLIGHT), name)
+        try:
+            if now - os.path.getmtime(path) < cfg.UPLOAD_LEASE:
+                continue
+        except FileNotFoundError:
+            continue
+        pending_path = os.path.join(spool_dir(cfg, PENDING), name)
+        if os.path.exists(pending_path):
+            # A newer capture of the same artifact is already queued
+            _remove(path)
+            continue
+        try:
+            os.rename(path, pending_path)
+        except FileNotFoundError:
+            # Another worker recovered it first
+            continue
+        print(f"Recovered stale upload {name[:-len(JOB_SUFFIX)]}.")
+
+
+def retry_delay(cfg, attempts):
+    # Exponential backoff with jitter, so several workers do not retry in lockstep
+    delay = min(cfg.UPLOAD_RETRY_BASE * 2 ** (attempts - 1), cfg.UPLOAD_RETRY_MAX)
+    return delay * random.uniform(0.5, 1.0)
+
+
+class Spool:
+    # Drains the upload spool with UPLOAD_CONCURRENCY parallel gdrive uploads.
+    # While a job is being uploaded its file's mtime is renewed as a lease; see recover().
+
+    def __init__(self, cfg):
+        self.cfg = cfg
+        self.min_start_gap = 60 / cfg.UPLOAD_MAX_PER_MINUTE if cfg.UPLOAD_MAX_PER_MINUTE else 0
+        self._next_start = 0.0
+        self._start_lock = threading.Lock()
+        self._leases = set()
+        self._lease_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._renew_leases, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _renew_leases(self):
+        while not self._stop.wait(self.cfg.UPLOAD_LEASE / 3):
+            with self._lease_lock:
+                paths = list(self._leases)
+            for path in paths:
+                try:
+                    os.utime(path)
+                except FileNotFoundError:
+                    pass
+
+    def _wait_turn(self):
+        # Spaces upload starts UPLOAD_MAX_PER_MINUTE apart across all worker threads
+        if not self.min_start_gap:
+            return
+        with self._start_lock:
+            now = time.monotonic()
+            if self._next_start > now:
+                time.sleep(self._next_start - now)
+                now = self._next_start
+            self._next_start = now + self.min_start_gap
+
+    def due_jobs(self, names=None):
+        now = time.time()
+        inflight = set(_job_files(self.cfg, INFLIGHT))
+        due = []
+        for name in _job_files(self.cfg, PENDING):
+            # Wait for a running upload of the same artifact to finish first
+            if name in inflight or (names is not None and name not in names):
+                continue
+            try:
+                job = _read_job(os.path.join(spool_dir(self.cfg, PENDING), name))
+            except FileNotFoundError:
+                continue
+            except ValueError:
+                due.append((0, name))
+                continue
+            if job['next_attempt'] <= now:
+                due.append((job['enqueued'], name))
+        return [name for _, name in sorted(due)]
+
+    def claim(self, name):
+        inflight_path = os.path.join(spool_dir(self.cfg, INFLIGHT), name)
+        try:
+            os.rename(os.path.join(spool_dir(self.cfg, PENDING), name), inflight_path)
+        except FileNotFoundError:
+            # Another worker claimed it first
+            return None
+        # The rename kept the pending file's mtime; start a fresh lease
+        os.utime(inflight_path)
+        return inflight_path
+
+    def process(self, name):
+        # Uploads one job; returns True when uploaded, False when it failed, None if another worker took it
+        label = name[:-len(JOB_SUFFIX)]
+        inflight_path = self.claim(name)
+        if inflight_path is None:
+            return None
+        try:
+            job = _read_job(inflight_path)
+        except ValueError:
+            os.rename(inflight_path, os.path.join(spool_dir(self.cfg, FAILED), name))
+            print(f"Upload job {label} is corrupt, moved to {FAILED}/.")
+            return False
+
+        with self._lease_lock:
+            self._leases.add(inflight_path)
+        try:
+            if not os.path.isfile(job['path']):
+                error, retry = f"{job['path']} no longer exists", False
+            else:
+                self._wait_turn()
+                print(f"Uploading {label} to Google Drive folder {job['parent']}...")
+                gdrive_cmd = ['gdrive', 'files', 'upload', '--parent', job['parent'], job['path']]
+                try:
+                    result = subprocess.run(gdrive_cmd, capture_output=True, text=True)
+                except OSError as e:
+                    result, error, retry = None, f"could not run gdrive: {e}", True
+                if result is not None and result.returncode == 0:
+                    _remove(inflight_path)
+                    print(f"Uploaded {label}.")
+                    return True
+                if result is not None:
+                    output = (result.stderr or result.stdout).strip().splitlines()
+                    error, retry = output[-1] if output else f"gdrive exited with {result.returncode}", True
+        finally:
+            with self._lease_lock:
+                self._leases.discard(inflight_path)
+
+        job['attempts'] += 1
+        job['last_error'] = error
+        if not retry or job['attempts'] >= self.cfg.UPLOAD_MAX_ATTEMPTS:
+            _write_job(os.path.join(spool_dir(self.cfg, FAILED), name), job)
+            _remove(inflight_path)
+            print(f"Giving up on {label} after {job['attempts']} attempt(s): {error}")
+            return False
+
+        pending_path = os.path.join(spool_dir(self.cfg, PENDING), name)
+        if os.path.exists(pending_path):
+            # Superseded by a newer capture queued while this one was uploading
+            _remove(inflight_path)
+        else:
+            delay = retry_delay(self.cfg, job['attempts'])
+            job['next_attempt'] = time.time() + delay
+            _write_job(inflight_path, job)
+            os.rename(inflight_path, pending_path)
+            print(f"Upload of {label} failed (attempt {job['attempts']}/{self.cfg.UPLOAD_MAX_ATTEMPTS}): "
+                  f"{error}. Retrying in {delay:.0f}s.")
+        return False
+
+    def drain(self, names=None):
+        # Uploads every job that is due once; returns (uploaded, failed)
+        recover(self.cfg)
+        due = self.due_jobs(names)
+        if not due:
+            return 0, 0
+        with ThreadPoolExecutor(max_workers=self.cfg.UPLOAD_CONCURRENCY) as pool:
+            results = list(pool.map(self.process, due))
+        return results.count(True), results.count(False)
+
+    def run(self):
+        while True:
+            self.drain()
+            time.sleep(self.cfg.UPLOAD_POLL_INTERVAL)
+
+
+def ship(cfg, paths):
+    # Called by the backup scripts once their artifacts are in LOCAL_BACKUP_DIR; returns an exit code.
+    # The jobs are spooled first in both modes, so nothing captured is lost if the upload fails.
+    names = [enqueue(cfg, path) for path in paths]
+    if cfg.UPLOAD_MODE == 'spool':
+        print(f"Queued {len(names)} file(s) for upload to Google Drive folder {cfg.GDRIVE_FOLDER_ID}.")
+        return 0
+    with Spool(cfg) as spool:
+        _, failed = spool.drain(set(names))
+    return 1 if failed else 0
+
+
+def print_status(cfg):
+    now = time.time()
+    for state in (PENDING, INFLIGHT, FAILED):
+        names = _job_files(cfg, state)
+        print(f"{state} ({len(names)}):")
+        for name in names:
+            try:
+                job = _read_job(os.path.join(spool_dir(cfg, state), name))
+            except (OSError, ValueError):
+                print(f"  {name[:-len(JOB_SUFFIX)]}  (unreadable)")
+                continue
+            details = [f"queued {datetime.fromtimestamp(job['enqueued']):%Y-%m-%d %H:%M}"]
+            if job['attempts']:
+                details.append(f"{job['attempts']} attempt(s)")
+            if state == PENDING and job['next_attempt'] > now:
+                details.append(f"next try in {job['next_attempt'] - now:.0f}s")
+            if job['last_error']:
+                details.append(f"last error: {job['last_error']}")
+            print(f"  {name[:-len(JOB_SUFFIX)]}  ({', '.join(details)})")
+
+
+def retry_failed(cfg):
+    names = _job_files(cfg, FAILED)
+    for name in names:
+        path = os.path.join(spool_dir(cfg, FAILED), name)
+        try:
+            job = _read_job(path)
+        except ValueError:
+            continue
+        job.update(attempts=0, next_attempt=0, last_error=None)
+        _write_job(os.path.join(spool_dir(cfg, PENDING), name), job)
+        _remove(path)
+    print(f"Requeued {len(names)} failed upload(s).")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Upload spooled backups to Google Drive")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--once', action='store_true', help="upload every job that is due, then exit")
+    mode.add_argument('--status', action='store_true', help="list pending, in-flight and failed uploads")
+    mode.add_argument('--retry-failed', action='store_true', help="requeue uploads that gave up")
+    args = parser.parse_args(argv)
+
+    cfg = load_config()
+    require(cfg, 'LOCAL_BACKUP_DIR')
+    ensure_backup_dir(cfg)
+
+    if args.status:
+        print_status(cfg)
+        return
+    if args.retry_failed:
+        retry_failed(cfg)
+        return
+
+    with Spool(cfg) as spool:
+        if args.once:
+            uploaded, failed = spool.drain()
+            print(f"Uploaded {uploaded} file(s), {failed} failed.")
+            if failed:
+                sys.exit(1)
+            return
+
+        print(f"Draining upload spool every {cfg.UPLOAD_POLL_INTERVAL}s "
+              f"({cfg.UPLOAD_CONCURRENCY} concurrent upload(s))...")
+        try:
+            spool.run()
+        except KeyboardInterrupt:
+            print("\nStopped.")
+
+
+if __name__ == '__main__':
+    main()